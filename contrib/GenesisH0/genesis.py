@@ -128,25 +128,48 @@ def generate_hash(data_block, algorithm, start_nonce, bits):
   # https://en.bitcoin.it/wiki/Difficulty
   target = (bits & 0xffffff) * 2**(8*((bits >> 24) - 3))
 
+  if algorithm == 'SHA256':
+    return generate_sha256_hash(data_block, start_nonce, target)
+
   while True:
-    sha256_hash, header_hash = generate_hashes_from_block(data_block, algorithm)
-    last_updated             = calculate_hashrate(nonce, last_updated)
+    header_hash  = generate_pow_hash_from_block(data_block, algorithm)
+    last_updated = calculate_hashrate(nonce, last_updated)
     if is_genesis_hash(header_hash, target):
       if algorithm == "X11" or algorithm == "X13" or algorithm == "X15":
         return (header_hash, nonce)
-      return (sha256_hash, nonce)
+      return (generate_sha256_hash_from_block(data_block), nonce)
     else:
      nonce      = nonce + 1
      data_block = data_block[0:len(data_block) - 4] + struct.pack('<I', nonce)  
 
 
-def generate_hashes_from_block(data_block, algorithm):
-  sha256_hash = hashlib.sha256(hashlib.sha256(data_block).digest()).digest()[::-1]
+# The sha256 state after the first 64 header bytes (the midstate) doesn't
+# depend on the nonce, so only the last 16 bytes are hashed per nonce.
+def generate_sha256_hash(data_block, start_nonce, target):
+  nonce        = start_nonce
+  last_updated = time.time()
+  midstate     = hashlib.sha256(data_block[0:64])
+  tail         = data_block[64:76]
+  target_hash  = ('%064x' % target).decode('hex')
+
+  while True:
+    sha256 = midstate.copy()
+    sha256.update(tail + struct.pack('<I', nonce))
+    sha256_hash  = hashlib.sha256(sha256.digest()).digest()[::-1]
+    last_updated = calculate_hashrate(nonce, last_updated)
+    if sha256_hash < target_hash:
+      return (sha256_hash, nonce)
+    nonce = nonce + 1
+
+
+def generate_sha256_hash_from_block(data_block):
+  return hashlib.sha256(hashlib.sha256(data_block).digest()).digest()[::-1]
+
+
+def generate_pow_hash_from_block(data_block, algorithm):
   header_hash = ""
   if algorithm == 'scrypt':
     header_hash = scrypt.hash(data_block,data_block,1024,1,1,32)[::-1] 
-  elif algorithm == 'SHA256':
-    header_hash = sha256_hash
   elif algorithm == 'X11':
     try:
       exec('import %s' % "xcoin_hash")
@@ -165,7 +188,7 @@ def generate_hashes_from_block(data_block, algorithm):
     except ImportError:
       sys.exit("Cannot run X15 algorithm: module x15_hash not found")
     header_hash = x15_hash.getPoWHash(data_block)[::-1]
-  return sha256_hash, header_hash
+  return header_hash
 
 
 def is_genesis_hash(header_hash, target):
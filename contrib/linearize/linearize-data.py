@@ -1,4 +1,4 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 #
 # linearize-data.py: Construct a linear, no-fork version of the chain.
 #
@@ -7,60 +7,32 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 #
 
-from __future__ import print_function, division
-import json
 import struct
 import re
 import os
 import os.path
-import base64
-import httplib
+import errno
 import sys
 import hashlib
 import datetime
 import time
-from collections import namedtuple
+import heapq
+import mmap
+import multiprocessing
+import importlib.util
+from array import array
+from collections import namedtuple, OrderedDict
 
 settings = {}
 
-def uint32(x):
-	return x & 0xffffffffL
-
-def bytereverse(x):
-	return uint32(( ((x) << 24) | (((x) << 8) & 0x00ff0000) |
-		       (((x) >> 8) & 0x0000ff00) | ((x) >> 24) ))
-
-def bufreverse(in_buf):
-	out_words = []
-	for i in range(0, len(in_buf), 4):
-		word = struct.unpack('@I', in_buf[i:i+4])[0]
-		out_words.append(struct.pack('@I', bytereverse(word)))
-	return ''.join(out_words)
-
-def wordreverse(in_buf):
-	out_words = []
-	for i in range(0, len(in_buf), 4):
-		out_words.append(in_buf[i:i+4])
-	out_words.reverse()
-	return ''.join(out_words)
+# Input files kept open for copying out-of-order blocks
+MAX_OPEN_INPUT_FILES = 64
 
 def calc_hdr_hash(blk_hdr):
-	hash1 = hashlib.sha256()
-	hash1.update(blk_hdr)
-	hash1_o = hash1.digest()
-
-	hash2 = hashlib.sha256()
-	hash2.update(hash1_o)
-	hash2_o = hash2.digest()
-
-	return hash2_o
+	return hashlib.sha256(hashlib.sha256(blk_hdr).digest()).digest()
 
 def calc_hash_str(blk_hdr):
-	hash = calc_hdr_hash(blk_hdr)
-	hash = bufreverse(hash)
-	hash = wordreverse(hash)
-	hash_str = hash.encode('hex')
-	return hash_str
+	return calc_hdr_hash(blk_hdr)[::-1].hex()
 
 def get_blk_dt(blk_hdr):
 	members = struct.unpack("<I", blk_hdr[68:68+4])
@@ -69,23 +41,202 @@ def get_blk_dt(blk_hdr):
 	dt_ym = datetime.datetime(dt.year, dt.month, 1)
 	return (dt_ym, nTime)
 
+def linearize_hashes():
+	'''The linearize-hashes.py module next to this script'''
+	if 'linearize_hashes' not in sys.modules:
+		spec = importlib.util.spec_from_file_location('linearize_hashes',
+				os.path.join(os.path.dirname(os.path.abspath(__file__)), 'linearize-hashes.py'))
+		module = importlib.util.module_from_spec(spec)
+		spec.loader.exec_module(module)
+		sys.modules['linearize_hashes'] = module
+	return sys.modules['linearize_hashes']
+
 def get_block_hashes(settings):
 	blkindex = []
-	f = open(settings['hashlist'], "r")
-	for line in f:
-		line = line.rstrip()
-		blkindex.append(line)
+	if 'hashlist' in settings:
+		f = open(settings['hashlist'], "r")
+		for line in f:
+			line = line.rstrip()
+			blkindex.append(line)
+	else:
+		# No hash list file, fetch the hashes from navcoind as linearize-hashes.py would
+		for hashes in linearize_hashes().get_block_hashes(settings):
+			blkindex.extend(hashes)
 
 	print("Read " + str(len(blkindex)) + " hashes")
 
 	return blkindex
 
 def mkblockmap(blkindex):
+	'''Map each block's header hash, as calc_hdr_hash returns it, to its height'''
 	blkmap = {}
 	for height,hash in enumerate(blkindex):
-		blkmap[hash] = height
+		blkmap[bytes.fromhex(hash)[::-1]] = height
 	return blkmap
 
+def map_block_file(fname):
+	'''Map an input file read-only, or return None if it is empty'''
+	with open(fname, "rb") as f:
+		if os.fstat(f.fileno()).st_size == 0:
+			return None
+		return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def scan_block_file(args):
+	'''
+	Index the blocks of one input file from offset start, in file order. Runs
+	in a worker process and returns (fn, end, hashes, offsets, sizes, error):
+	the offset after the last complete block, the header hashes concatenated,
+	the offset and size of each block's data after its header, and a message
+	if the file has invalid data after the indexed blocks.
+	'''
+	(fn, fname, netmagic, start) = args
+	hashes = []
+	offsets = array('Q')
+	sizes = array('I')
+	error = None
+	mm = map_block_file(fname)
+	if mm is None:
+		return (fn, start, b'', offsets, sizes, error)
+	with mm:
+		if hasattr(mm, 'madvise'):
+			mm.madvise(mmap.MADV_SEQUENTIAL)
+		end = len(mm)
+		pos = start
+		while pos + 88 <= end:
+			if mm[pos] == 0:
+				break # unused space after the last block
+			if mm[pos:pos+4] != netmagic:
+				error = "Invalid magic: " + mm[pos:pos+4].hex()
+				break
+			inLen = struct.unpack_from("<I", mm, pos + 4)[0]
+			if pos + 8 + inLen > end:
+				break # block still being written
+			hashes.append(calc_hdr_hash(mm[pos+8:pos+88]))
+			offsets.append(pos + 88)
+			sizes.append(inLen - 80)
+			pos += 8 + inLen
+	return (fn, pos, b''.join(hashes), offsets, sizes, error)
+
+def copy_file_range(inFd, outFd, offset, count):
+	return os.copy_file_range(inFd, outFd, count, offset)
+
+def sendfile(inFd, outFd, offset, count):
+	return os.sendfile(outFd, inFd, offset, count)
+
+# Ways of copying between files in the kernel, in order of preference
+KERNEL_COPY = []
+if hasattr(os, 'copy_file_range'):
+	KERNEL_COPY.append(copy_file_range)
+if hasattr(os, 'sendfile'):
+	KERNEL_COPY.append(sendfile)
+
+# Errors from a kernel copy that mean it does not support these files
+KERNEL_COPY_UNSUPPORTED = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP)
+
+def le_bytes(a):
+	'''Little-endian contents of an array'''
+	if sys.byteorder == 'big':
+		a = array(a.typecode, a)
+		a.byteswap()
+	return a.tobytes()
+
+def le_array(typecode, data):
+	'''Array from little-endian bytes'''
+	a = array(typecode, data)
+	if sys.byteorder == 'big':
+		a.byteswap()
+	return a
+
+class ExtentIndex:
+	'''
+	On-disk index of the input files and of the copy progress, kept next to
+	the output so that a later run can resume (incremental=1) instead of
+	rescanning every input file.
+
+	After an 8-byte magic the file is a sequence of records, only ever
+	appended to:
+	  FILE: fn, end, count, then count header hashes (32 bytes), data offsets
+	        (uint64) and data sizes (uint32) of the blocks in input file fn
+	        up to offset end. Later records for a file continue it.
+	  PROG: height, output file number and size, highest block time and the
+	        hash of the last block written, all flushed to the output.
+	A partial record at the end, left by an interrupted run, is dropped.
+	'''
+	MAGIC = b'LINIDX01'
+	FILE = struct.Struct('<4sIQI')
+	PROG = struct.Struct('<4sIIQI32s')
+
+	def __init__(self, fname):
+		self.fname = fname
+		self.f = None
+		self.files = {} # fn -> (end, hashes, offsets, sizes) read from disk
+		self.progress = None # (height, outFn, outsz, highTS, hash) of the last PROG record
+
+	def open(self, incremental):
+		'''Load the index if incremental and it exists, otherwise start a new one'''
+		if incremental and os.path.exists(self.fname):
+			self.f = open(self.fname, "r+b")
+			valid = self.load(self.f.read())
+			self.f.seek(valid)
+			self.f.truncate()
+			if valid == 0:
+				self.f.write(self.MAGIC)
+		else:
+			self.f = open(self.fname, "wb")
+			self.f.write(self.MAGIC)
+			self.f.flush()
+
+	def load(self, data):
+		'''Parse the records in data, returning the length of the valid part'''
+		if data[:len(self.MAGIC)] != self.MAGIC:
+			return 0
+		pos = len(self.MAGIC)
+		while pos + 4 <= len(data):
+			tag = data[pos:pos+4]
+			if tag == b'FILE' and pos + self.FILE.size <= len(data):
+				(tag, fn, end, count) = self.FILE.unpack_from(data, pos)
+				hashesPos = pos + self.FILE.size
+				offsetsPos = hashesPos + 32 * count
+				sizesPos = offsetsPos + 8 * count
+				recEnd = sizesPos + 4 * count
+				if recEnd > len(data):
+					break
+				self.files[fn] = self.mergeFile(fn, end, data[hashesPos:offsetsPos],
+						le_array('Q', data[offsetsPos:sizesPos]), le_array('I', data[sizesPos:recEnd]))
+			elif tag == b'PROG' and pos + self.PROG.size <= len(data):
+				self.progress = self.PROG.unpack_from(data, pos)[1:]
+				recEnd = pos + self.PROG.size
+			else:
+				break
+			pos = recEnd
+		return pos
+
+	def mergeFile(self, fn, end, hashes, offsets, sizes):
+		'''Append blocks to those known for input file fn, returning them all'''
+		if fn in self.files:
+			(oldEnd, oldHashes, oldOffsets, oldSizes) = self.files.pop(fn)
+			hashes = oldHashes + hashes
+			oldOffsets.extend(offsets)
+			oldSizes.extend(sizes)
+			(offsets, sizes) = (oldOffsets, oldSizes)
+		return (end, hashes, offsets, sizes)
+
+	def addFile(self, fn, end, hashes, offsets, sizes):
+		'''Record newly scanned blocks of input file fn, returning all of its blocks'''
+		self.f.write(self.FILE.pack(b'FILE', fn, end, len(offsets)))
+		self.f.write(hashes)
+		self.f.write(le_bytes(offsets))
+		self.f.write(le_bytes(sizes))
+		self.f.flush()
+		return self.mergeFile(fn, end, hashes, offsets, sizes)
+
+	def checkpoint(self, height, outFn, outsz, highTS, hash):
+		self.f.write(self.PROG.pack(b'PROG', height, outFn, outsz, highTS, hash))
+		self.f.flush()
+
+	def close(self):
+		self.f.close()
+
 # Block header and extent on disk
 BlockExtent = namedtuple('BlockExtent', ['fn', 'offset', 'inhdr', 'blkhdr', 'size'])
 
@@ -95,14 +246,13 @@ class BlockDataCopier:
 		self.blkindex = blkindex
 		self.blkmap = blkmap
 
-		self.inFn = 0
-		self.inF = None
 		self.outFn = 0
 		self.outsz = 0
 		self.outF = None
 		self.outFname = None
 		self.blkCountIn = 0
 		self.blkCountOut = 0
+		self.checkpointHeight = 0
 
 		self.lastDate = datetime.datetime(2000, 1, 1)
 		self.highTS = 1408893517 - 315360000
@@ -120,60 +270,166 @@ class BlockDataCopier:
 		self.blockExtents = {}
 		self.outOfOrderData = {}
 		self.outOfOrderSize = 0 # running total size for items in outOfOrderData
+		self.outOfOrderHeights = [] # max-heap (negated) of the heights in outOfOrderData, may hold stale entries
+		self.cacheHits = 0
+		self.cacheMisses = 0 # out-of-order blocks read back from disk, each a seek
+		self.cacheEvictions = 0
+		# Open input files, least recently used first
+		self.openInFiles = OrderedDict()
+		self.kernelCopy = list(KERNEL_COPY) if settings['zero_copy'] != 0 else []
+
+	def outFileName(self):
+		if self.fileOutput:
+			return self.settings['output_file']
+		return os.path.join(self.settings['output'], "blk%05d.dat" % self.outFn)
+
+	def resume(self, progress):
+		'''Continue the output at a checkpoint of a previous run, if it is on this hash list'''
+		(height, outFn, outsz, highTS, hash) = progress
+		if height > len(self.blkindex) or (height > 0 and bytes.fromhex(self.blkindex[height-1])[::-1] != hash):
+			return False
+		self.blkCountOut = height
+		self.checkpointHeight = height
+		self.outFn = outFn
+		self.highTS = highTS
+		dt = datetime.datetime.fromtimestamp(highTS)
+		self.lastDate = datetime.datetime(dt.year, dt.month, 1)
+		if outsz > 0:
+			# Drop anything written after the checkpoint
+			self.outFname = self.outFileName()
+			self.outF = open(self.outFname, "r+b")
+			self.outF.truncate(outsz)
+			self.outF.seek(outsz)
+			self.outsz = outsz
+		print("Resuming at height %i" % height)
+		return True
+
+	def checkpoint(self):
+		'''Record the progress in the index once the output is flushed'''
+		if self.outF:
+			self.outF.flush()
+		if self.blkCountOut > self.checkpointHeight:
+			self.checkpointHeight = self.blkCountOut
+			self.index.checkpoint(self.blkCountOut, self.outFn, self.outsz, self.highTS,
+					bytes.fromhex(self.blkindex[self.blkCountOut-1])[::-1])
+
+	def closeOutput(self):
+		self.outF.close()
+		if self.setFileTime:
+			os.utime(self.outFname, (int(time.time()), self.highTS))
+		self.outF = None
+		self.outFname = None
+		self.outFn = self.outFn + 1
+		self.outsz = 0
 
-	def writeBlock(self, inhdr, blk_hdr, rawblock):
-		blockSizeOnDisk = len(inhdr) + len(blk_hdr) + len(rawblock)
+	def writeBlock(self, extent, rawblock=None):
+		'''Write a block, copying its data from the input file unless given'''
+		inhdr = extent.inhdr
+		blk_hdr = extent.blkhdr
+		blockSizeOnDisk = len(inhdr) + len(blk_hdr) + extent.size
 		if not self.fileOutput and ((self.outsz + blockSizeOnDisk) > self.maxOutSz):
-			self.outF.close()
-			if self.setFileTime:
-				os.utime(outFname, (int(time.time()), highTS))
-			self.outF = None
-			self.outFname = None
-			self.outFn = self.outFn + 1
-			self.outsz = 0
+			self.closeOutput()
 
 		(blkDate, blkTS) = get_blk_dt(blk_hdr)
 		if self.timestampSplit and (blkDate > self.lastDate):
-			print("New month " + blkDate.strftime("%Y-%m") + " @ " + hash_str)
-			lastDate = blkDate
-			if outF:
-				outF.close()
-				if setFileTime:
-					os.utime(outFname, (int(time.time()), highTS))
-				self.outF = None
-				self.outFname = None
-				self.outFn = self.outFn + 1
-				self.outsz = 0
+			print("New month " + blkDate.strftime("%Y-%m") + " @ " + calc_hash_str(blk_hdr))
+			self.lastDate = blkDate
+			if self.outF:
+				self.closeOutput()
 
 		if not self.outF:
-			if self.fileOutput:
-				outFname = self.settings['output_file']
-			else:
-				outFname = os.path.join(self.settings['output'], "blk%05d.dat" % self.outFn)
-			print("Output file " + outFname)
-			self.outF = open(outFname, "wb")
+			self.outFname = self.outFileName()
+			print("Output file " + self.outFname)
+			self.outF = open(self.outFname, "wb")
 
 		self.outF.write(inhdr)
 		self.outF.write(blk_hdr)
-		self.outF.write(rawblock)
-		self.outsz = self.outsz + len(inhdr) + len(blk_hdr) + len(rawblock)
+		if rawblock is None:
+			self.copyExtent(extent)
+		else:
+			self.outF.write(rawblock)
+		self.outsz = self.outsz + blockSizeOnDisk
 
 		self.blkCountOut = self.blkCountOut + 1
 		if blkTS > self.highTS:
 			self.highTS = blkTS
 
 		if (self.blkCountOut % 1000) == 0:
-			print('%i blocks scanned, %i blocks written (of %i, %.1f%% complete)' % 
+			print('%i blocks scanned, %i blocks written (of %i, %.1f%% complete)' %
 					(self.blkCountIn, self.blkCountOut, len(self.blkindex), 100.0 * self.blkCountOut / len(self.blkindex)))
+			self.printCacheStats()
+
+	def printCacheStats(self):
+		print('Out-of-order cache: %i hits, %i misses (seeks), %i evicted, %i blocks (%i bytes) cached' %
+				(self.cacheHits, self.cacheMisses, self.cacheEvictions, len(self.outOfOrderData), self.outOfOrderSize))
+
+	def cacheBlock(self, height, rawblock):
+		'''
+		Keep the data of an out-of-order block in memory if there is room,
+		evicting blocks that are needed later than it to make room.
+		'''
+		size = len(rawblock)
+		limit = self.settings['out_of_order_cache_sz']
+		heights = self.outOfOrderHeights
+		while self.outOfOrderSize + size > limit and heights and -heights[0] > height:
+			evicted = -heapq.heappop(heights)
+			if evicted in self.outOfOrderData:
+				self.outOfOrderSize -= len(self.outOfOrderData.pop(evicted))
+				self.cacheEvictions += 1
+		if self.outOfOrderSize + size > limit:
+			return
+
+		self.outOfOrderData[height] = rawblock.tobytes()
+		self.outOfOrderSize += size
+		heapq.heappush(heights, -height)
+		if len(heights) > 2 * len(self.outOfOrderData) + 1024:
+			# Drop the entries of blocks since written
+			self.outOfOrderHeights = [-h for h in self.outOfOrderData]
+			heapq.heapify(self.outOfOrderHeights)
 
 	def inFileName(self, fn):
 		return os.path.join(self.settings['input'], "blk%05d.dat" % fn)
 
-	def fetchBlock(self, extent):
-		'''Fetch block contents from disk given extents'''
-		with open(self.inFileName(extent.fn), "rb") as f:
-			f.seek(extent.offset)
-			return f.read(extent.size)
+	def inFile(self, fn):
+		'''Open input file fn, keeping the most recently used ones open'''
+		if fn in self.openInFiles:
+			self.openInFiles.move_to_end(fn)
+			return self.openInFiles[fn]
+		if len(self.openInFiles) >= MAX_OPEN_INPUT_FILES:
+			self.openInFiles.popitem(last=False)[1].close()
+		f = open(self.inFileName(fn), "rb", buffering=0)
+		self.openInFiles[fn] = f
+		return f
+
+	def inFiles(self):
+		'''Arguments to scan_block_file for each input file, in order, skipping the indexed part'''
+		fn = 0
+		while os.path.exists(self.inFileName(fn)):
+			start = self.index.files[fn][0] if fn in self.index.files else 0
+			yield (fn, self.inFileName(fn), self.settings['netmagic'], start)
+			fn += 1
+
+	def copyExtent(self, extent):
+		'''Copy block contents from disk to the output given extents, in the kernel where supported'''
+		inF = self.inFile(extent.fn)
+		offset = extent.offset
+		end = extent.offset + extent.size
+		if self.kernelCopy:
+			self.outF.flush()
+		while self.kernelCopy and offset < end:
+			try:
+				copied = self.kernelCopy[0](inF.fileno(), self.outF.fileno(), offset, end - offset)
+			except OSError as e:
+				if e.errno not in KERNEL_COPY_UNSUPPORTED:
+					raise
+				self.kernelCopy.pop(0)
+				continue
+			if copied == 0:
+				raise IOError("Unexpected end of " + inF.name)
+			offset += copied
+		if offset < end:
+			inF.seek(offset)
+			self.outF.write(inF.read(end - offset))
 
 	def copyOneBlock(self):
 		'''Find the next block to be written in the input, and copy it to the output.'''
@@ -182,68 +438,95 @@ class BlockDataCopier:
 			# If the data is cached, use it from memory and remove from the cache
 			rawblock = self.outOfOrderData.pop(self.blkCountOut)
 			self.outOfOrderSize -= len(rawblock)
-		else: # Otherwise look up data on disk
-			rawblock = self.fetchBlock(extent)
-
-		self.writeBlock(extent.inhdr, extent.blkhdr, rawblock)
+			self.cacheHits += 1
+			self.writeBlock(extent, rawblock)
+		else: # Otherwise copy it from disk
+			self.cacheMisses += 1
+			self.writeBlock(extent)
+
+	def copyFile(self, fn, hashes, offsets, sizes):
+		'''Copy the blocks of an input file, given its index from scan_block_file'''
+		print("Input file " + self.inFileName(fn))
+		mm = None
+		try:
+			for i in range(len(offsets)):
+				if self.blkCountOut >= len(self.blkindex):
+					break
+				hash = hashes[32*i:32*i+32]
+				if not hash in self.blkmap:
+					print("Skipping unknown block " + hash[::-1].hex())
+					continue
+
+				blkHeight = self.blkmap[hash]
+				self.blkCountIn += 1
+				if blkHeight < self.blkCountOut:
+					continue # already written, e.g. by the run being resumed
+
+				if mm is None:
+					mm = map_block_file(self.inFileName(fn))
+					data = memoryview(mm)
+				offset = offsets[i]
+				extent = BlockExtent(fn, offset, mm[offset-88:offset-80], mm[offset-80:offset], sizes[i])
+				if self.blkCountOut == blkHeight:
+					# If in-order block, just copy
+					if self.kernelCopy:
+						self.writeBlock(extent)
+					else:
+						self.writeBlock(extent, data[offset:offset+sizes[i]])
+
+					# See if we can catch up to prior out-of-order blocks
+					while self.blkCountOut in self.blockExtents:
+						self.copyOneBlock()
+
+				else: # If out-of-order, skip over block data for now
+					self.blockExtents[blkHeight] = extent
+					# Reading the data in file sequence instead of seeking and fetching it later is preferred,
+					# but we don't want to fill up memory: keep the blocks needed soonest
+					self.cacheBlock(blkHeight, data[offset:offset+sizes[i]])
+		finally:
+			if mm is not None:
+				data.release()
+				mm.close()
 
 	def run(self):
-		while self.blkCountOut < len(self.blkindex):
-			if not self.inF:
-				fname = self.inFileName(self.inFn)
-				print("Input file " + fname)
-				try:
-					self.inF = open(fname, "rb")
-				except IOError:
-					print("Premature end of block data")
+		self.index = ExtentIndex(self.settings['index_file'])
+		self.index.open(self.settings['incremental'] != 0)
+		if self.index.progress is not None and not self.resume(self.index.progress):
+			print("Hash list does not match the output, run without incremental to rebuild it")
+			self.index.close()
+			return
+
+		# Index the input files in worker processes, copying from each file
+		# in order as soon as its index is available. Files known to the
+		# index are only scanned past their indexed end.
+		pool = multiprocessing.Pool(self.settings['scan_processes'])
+		try:
+			for (fn, end, hashes, offsets, sizes, error) in pool.imap(scan_block_file, self.inFiles()):
+				if len(offsets) > 0 or fn not in self.index.files:
+					(end, hashes, offsets, sizes) = self.index.addFile(fn, end, hashes, offsets, sizes)
+				else:
+					(end, hashes, offsets, sizes) = self.index.files.pop(fn)
+				self.copyFile(fn, hashes, offsets, sizes)
+				self.checkpoint()
+				if self.blkCountOut >= len(self.blkindex):
+					break
+				if error is not None:
+					print(error)
 					return
-
-			inhdr = self.inF.read(8)
-			if (not inhdr or (inhdr[0] == "\0")):
-				self.inF.close()
-				self.inF = None
-				self.inFn = self.inFn + 1
-				continue
-
-			inMagic = inhdr[:4]
-			if (inMagic != self.settings['netmagic']):
-				print("Invalid magic: " + inMagic.encode('hex'))
-				return
-			inLenLE = inhdr[4:]
-			su = struct.unpack("<I", inLenLE)
-			inLen = su[0] - 80 # length without header
-			blk_hdr = self.inF.read(80)
-			inExtent = BlockExtent(self.inFn, self.inF.tell(), inhdr, blk_hdr, inLen)
-
-			hash_str = calc_hash_str(blk_hdr)
-			if not hash_str in blkmap:
-				print("Skipping unknown block " + hash_str)
-				self.inF.seek(inLen, os.SEEK_CUR)
-				continue
-
-			blkHeight = self.blkmap[hash_str]
-			self.blkCountIn += 1
-
-			if self.blkCountOut == blkHeight:
-				# If in-order block, just copy
-				rawblock = self.inF.read(inLen)
-				self.writeBlock(inhdr, blk_hdr, rawblock)
-
-				# See if we can catch up to prior out-of-order blocks
-				while self.blkCountOut in self.blockExtents:
-					self.copyOneBlock()
-
-			else: # If out-of-order, skip over block data for now
-				self.blockExtents[blkHeight] = inExtent
-				if self.outOfOrderSize < self.settings['out_of_order_cache_sz']:
-					# If there is space in the cache, read the data
-					# Reading the data in file sequence instead of seeking and fetching it later is preferred,
-					# but we don't want to fill up memory
-					self.outOfOrderData[blkHeight] = self.inF.read(inLen)
-					self.outOfOrderSize += inLen
-				else: # If no space in cache, seek forward
-					self.inF.seek(inLen, os.SEEK_CUR)
-
+		finally:
+			pool.terminate()
+			pool.join()
+			if self.outF:
+				self.outF.close()
+			for f in self.openInFiles.values():
+				f.close()
+			self.index.close()
+
+		if self.blkCountOut < len(self.blkindex):
+			print("Premature end of block data")
+			return
+
+		self.printCacheStats()
 		print("Done (%i blocks written)" % (self.blkCountOut))
 
 if __name__ == '__main__':
@@ -254,12 +537,12 @@ if __name__ == '__main__':
 	f = open(sys.argv[1])
 	for line in f:
 		# skip comment lines
-		m = re.search('^\s*#', line)
+		m = re.search(r'^\s*#', line)
 		if m:
 			continue
 
 		# parse key=value lines
-		m = re.search('^(\w+)\s*=\s*(\S.*)$', line)
+		m = re.search(r'^(\w+)\s*=\s*(\S.*)$', line)
 		if m is None:
 			continue
 		settings[m.group(1)] = m.group(2)
@@ -271,33 +554,53 @@ if __name__ == '__main__':
 		settings['genesis'] = '000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f'
 	if 'input' not in settings:
 		settings['input'] = 'input'
-	if 'hashlist' not in settings:
+	if 'hashlist' not in settings and 'rpcuser' not in settings:
 		settings['hashlist'] = 'hashlist.txt'
 	if 'file_timestamp' not in settings:
 		settings['file_timestamp'] = 0
 	if 'split_timestamp' not in settings:
 		settings['split_timestamp'] = 0
 	if 'max_out_sz' not in settings:
-		settings['max_out_sz'] = 1000L * 1000 * 1000
+		settings['max_out_sz'] = 1000 * 1000 * 1000
 	if 'out_of_order_cache_sz' not in settings:
 		settings['out_of_order_cache_sz'] = 100 * 1000 * 1000
-
-	settings['max_out_sz'] = long(settings['max_out_sz'])
+	if 'scan_processes' not in settings:
+		settings['scan_processes'] = multiprocessing.cpu_count()
+	if 'incremental' not in settings:
+		settings['incremental'] = 0
+	if 'zero_copy' not in settings:
+		settings['zero_copy'] = 1
+
+	settings['max_out_sz'] = int(settings['max_out_sz'])
 	settings['split_timestamp'] = int(settings['split_timestamp'])
 	settings['file_timestamp'] = int(settings['file_timestamp'])
-	settings['netmagic'] = settings['netmagic'].decode('hex')
+	settings['netmagic'] = bytes.fromhex(settings['netmagic'])
 	settings['out_of_order_cache_sz'] = int(settings['out_of_order_cache_sz'])
+	settings['scan_processes'] = int(settings['scan_processes'])
+	settings['incremental'] = int(settings['incremental'])
+	settings['zero_copy'] = int(settings['zero_copy'])
 
 	if 'output_file' not in settings and 'output' not in settings:
 		print("Missing output file / directory")
 		sys.exit(1)
+	if 'index_file' not in settings:
+		if 'output' in settings:
+			settings['index_file'] = os.path.join(settings['output'], 'linearize.idx')
+		else:
+			settings['index_file'] = settings['output_file'] + '.idx'
+
+	if 'hashlist' not in settings and not linearize_hashes().set_defaults(settings):
+		print("Missing username and/or password in cfg file")
+		sys.exit(1)
 
-	blkindex = get_block_hashes(settings)
+	try:
+		blkindex = get_block_hashes(settings)
+	except RuntimeError as e:
+		print(e)
+		sys.exit(1)
 	blkmap = mkblockmap(blkindex)
 
-	if not settings['genesis'] in blkmap:
+	if not bytes.fromhex(settings['genesis'])[::-1] in blkmap:
 		print("Genesis block not found in hashlist")
 	else:
 		BlockDataCopier(settings, blkindex, blkmap).run()
-
-
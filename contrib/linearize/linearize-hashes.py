@@ -1,4 +1,4 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 #
 # linearize-hashes.py:  List blocks in a linear, no-fork version of the chain.
 #
@@ -7,21 +7,22 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 #
 
-from __future__ import print_function
 import json
-import struct
 import re
 import base64
-import httplib
+import http.client
 import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 settings = {}
 
 class NavCoinRPC:
 	def __init__(self, host, port, username, password):
 		authpair = "%s:%s" % (username, password)
-		self.authhdr = "Basic %s" % (base64.b64encode(authpair))
-		self.conn = httplib.HTTPConnection(host, port, False, 30)
+		self.authhdr = "Basic %s" % (base64.b64encode(authpair.encode('utf-8')).decode('ascii'))
+		self.conn = http.client.HTTPConnection(host, port, timeout=30)
 
 	def execute(self, obj):
 		self.conn.request('POST', '/', json.dumps(obj),
@@ -53,26 +54,73 @@ class NavCoinRPC:
 		return 'error' in resp_obj and resp_obj['error'] is not None
 
 def get_block_hashes(settings, max_blocks_per_call=10000):
-	rpc = NavCoinRPC(settings['host'], settings['port'],
-			 settings['rpcuser'], settings['rpcpassword'])
-
-	height = settings['min_height']
-	while height < settings['max_height']+1:
-		num_blocks = min(settings['max_height']+1-height, max_blocks_per_call)
+	'''
+	Yield the hashes of the blocks from min_height to max_height, as a list
+	per batch of getblockhash calls, in height order. The batches are sent
+	over rpc_connections keep-alive connections, with up to two batches in
+	flight per connection; later batches wait for earlier ones to be yielded.
+	'''
+	local = threading.local()
+
+	def fetch(height, num_blocks):
+		if not hasattr(local, 'rpc'):
+			local.rpc = NavCoinRPC(settings['host'], settings['port'],
+					settings['rpcuser'], settings['rpcpassword'])
+		rpc = local.rpc
 		batch = []
 		for x in range(num_blocks):
 			batch.append(rpc.build_request(x, 'getblockhash', [height + x]))
 
 		reply = rpc.execute(batch)
 
-		for x,resp_obj in enumerate(reply):
+		hashes = [None] * num_blocks
+		# In height order, so an error names the first height missing
+		for resp_obj in sorted(reply, key=lambda resp_obj: resp_obj['id']):
 			if rpc.response_is_error(resp_obj):
-				print('JSON-RPC: error at height', height+x, ': ', resp_obj['error'], file=sys.stderr)
-				exit(1)
-			assert(resp_obj['id'] == x) # assume replies are in-sequence
-			print(resp_obj['result'])
+				raise RuntimeError('JSON-RPC: error at height %i: %s' % (height+resp_obj['id'], resp_obj['error']))
+			hashes[resp_obj['id']] = resp_obj['result']
+		return hashes
+
+	connections = settings['rpc_connections']
+	executor = ThreadPoolExecutor(connections)
+	inFlight = deque()
+	heights = iter(range(settings['min_height'], settings['max_height']+1, max_blocks_per_call))
+	try:
+		while True:
+			while len(inFlight) < 2 * connections:
+				height = next(heights, None)
+				if height is None:
+					break
+				num_blocks = min(settings['max_height']+1-height, max_blocks_per_call)
+				inFlight.append(executor.submit(fetch, height, num_blocks))
+			if not inFlight:
+				break
+			yield inFlight.popleft().result()
+	finally:
+		for future in inFlight:
+			future.cancel()
+		executor.shutdown(wait=False)
+
+def set_defaults(settings):
+	'''Fill in and convert the RPC settings, returning False if credentials are missing'''
+	if 'host' not in settings:
+		settings['host'] = '127.0.0.1'
+	if 'port' not in settings:
+		settings['port'] = 5555
+	if 'min_height' not in settings:
+		settings['min_height'] = 0
+	if 'max_height' not in settings:
+		settings['max_height'] = 313000
+	if 'rpc_connections' not in settings:
+		settings['rpc_connections'] = 4
+	if 'rpcuser' not in settings or 'rpcpassword' not in settings:
+		return False
 
-		height += num_blocks
+	settings['port'] = int(settings['port'])
+	settings['min_height'] = int(settings['min_height'])
+	settings['max_height'] = int(settings['max_height'])
+	settings['rpc_connections'] = int(settings['rpc_connections'])
+	return True
 
 if __name__ == '__main__':
 	if len(sys.argv) != 2:
@@ -82,32 +130,24 @@ if __name__ == '__main__':
 	f = open(sys.argv[1])
 	for line in f:
 		# skip comment lines
-		m = re.search('^\s*#', line)
+		m = re.search(r'^\s*#', line)
 		if m:
 			continue
 
 		# parse key=value lines
-		m = re.search('^(\w+)\s*=\s*(\S.*)$', line)
+		m = re.search(r'^(\w+)\s*=\s*(\S.*)$', line)
 		if m is None:
 			continue
 		settings[m.group(1)] = m.group(2)
 	f.close()
 
-	if 'host' not in settings:
-		settings['host'] = '127.0.0.1'
-	if 'port' not in settings:
-		settings['port'] = 5555
-	if 'min_height' not in settings:
-		settings['min_height'] = 0
-	if 'max_height' not in settings:
-		settings['max_height'] = 313000
-	if 'rpcuser' not in settings or 'rpcpassword' not in settings:
-		print("Missing username and/or password in cfg file", file=stderr)
+	if not set_defaults(settings):
+		print("Missing username and/or password in cfg file", file=sys.stderr)
 		sys.exit(1)
 
-	settings['port'] = int(settings['port'])
-	settings['min_height'] = int(settings['min_height'])
-	settings['max_height'] = int(settings['max_height'])
-
-	get_block_hashes(settings)
-
+	try:
+		for hashes in get_block_hashes(settings):
+			sys.stdout.write('\n'.join(hashes) + '\n')
+	except RuntimeError as e:
+		print(e, file=sys.stderr)
+		sys.exit(1)
@@ -15,6 +15,26 @@ than:
       should run the tests.
     - `--coverage`: this generates a basic coverage report for the RPC
       interface.
+    - `-parallel=N`: run up to N tests at once (default: the number of
+      CPUs, at least 4).
+    - `-durations=FILE`: where to keep the duration of each test, which
+      is used to start the longest tests first (default:
+      qa/rpc-test-durations.json in the build directory).
+    - `--shard=I/N`: run only the I-th (counting from 0) of N shards of the
+      tests, balanced by their durations.  The shards are the same for the
+      same tests and durations file, so N machines sharing those can each
+      run one, or one machine can run them all at once.  A shard leaves the
+      durations file alone and writes the durations it measured into
+      `--shard-durations=FILE` (default: rpc-test-durations-shard-I-of-N.json
+      next to the durations file).
+    - `--merge-durations`: merge the shard durations files given as
+      arguments into the durations file, without running any tests.
+    - `--junit=FILE`: write the results as a JUnit XML file.
+    - `--merge-junit=FILE`: merge the JUnit XML files given as arguments
+      (e.g. one per shard) into FILE, without running any tests.
+    - `--report=FILE`: write the wall time, CPU time and peak RSS of each
+      test and its navcoinds, its RPC calls and P2P traffic into FILE, as
+      CSV if it ends in .csv and JSON otherwise.
 
 For a description of arguments recognized by test scripts, see
 `qa/pull-tester/test_framework/test_framework.py:NavCoinTestFramework.main`.
@@ -22,12 +42,17 @@ For a description of arguments recognized by test scripts, see
 """
 
 import os
+import json
 import time
 import shutil
 import sys
 import subprocess
 import tempfile
+import threading
+import queue
 import re
+import csv
+import xml.etree.ElementTree as ET
 
 sys.path.append("qa/pull-tester/")
 from tests_config import *
@@ -40,6 +65,9 @@ if os.name == 'posix':
 
 RPC_TESTS_DIR = SRCDIR + '/qa/rpc-tests/'
 
+sys.path.append(RPC_TESTS_DIR)
+from test_framework.util import MAX_NODES, PORT_RANGE
+
 #If imported values are not defined then set to zero (or disabled)
 if 'ENABLE_WALLET' not in vars():
     ENABLE_WALLET=0
@@ -50,6 +78,54 @@ if 'ENABLE_UTILS' not in vars():
 if 'ENABLE_ZMQ' not in vars():
     ENABLE_ZMQ=0
 
+def merge_junit(filename, inputs):
+    """
+    Merge the testsuites of several JUnit XML files (e.g. one per shard)
+    into one file.
+    """
+    merged = ET.Element('testsuites')
+    tests = failures = 0
+    runtime = 0.0
+    for name in inputs:
+        root = ET.parse(name).getroot()
+        for suite in ([root] if root.tag == 'testsuite' else root.findall('testsuite')):
+            merged.append(suite)
+            tests += int(suite.get('tests', 0))
+            failures += int(suite.get('failures', 0))
+            runtime = max(runtime, float(suite.get('time', 0)))
+    merged.set('tests', str(tests))
+    merged.set('failures', str(failures))
+    merged.set('time', '%.3f' % runtime)
+    ET.ElementTree(merged).write(filename, encoding='utf-8', xml_declaration=True)
+    print("Merged %d tests (%d failed) from %d files into %s" % (tests, failures, len(inputs), filename))
+
+def load_durations(filename):
+    try:
+        with open(filename, 'r', encoding='utf8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_durations(filename, durations):
+    try:
+        tmp = "%s.%d.tmp" % (filename, os.getpid())
+        with open(tmp, 'w', encoding='utf8') as f:
+            json.dump(durations, f, indent=1, sort_keys=True)
+        os.replace(tmp, filename)
+    except OSError as e:
+        print("Could not save test durations to %s: %s" % (filename, e))
+
+def merge_durations(filename, inputs):
+    """
+    Merge the durations measured by shards (see --shard-durations) into
+    the durations file that the next runs are ordered and sharded by.
+    """
+    durations = load_durations(filename)
+    for name in inputs:
+        durations.update(load_durations(name))
+    save_durations(filename, durations)
+    print("Merged the durations of %d files into %s" % (len(inputs), filename))
+
 ENABLE_COVERAGE=0
 
 #Create a set to store arguments and create the passon string
@@ -57,9 +133,22 @@ opts = set()
 passon_args = []
 PASSON_REGEX = re.compile("^--")
 PARALLEL_REGEX = re.compile('^-parallel=')
+DURATIONS_REGEX = re.compile('^-durations=')
+SHARD_REGEX = re.compile('^--shard=([0-9]+)/([0-9]+)$')
+SHARD_DURATIONS_REGEX = re.compile('^--shard-durations=')
+JUNIT_REGEX = re.compile('^--junit=')
+MERGE_JUNIT_REGEX = re.compile('^--merge-junit=')
+REPORT_REGEX = re.compile('^--report=')
 
 print_help = False
-run_parallel = 4
+run_parallel = None
+durations_file = BUILDDIR + '/qa/rpc-test-durations.json'
+shard = None
+shard_durations_file = None
+merge_durations_files = False
+junit_file = None
+merge_junit_file = None
+report_file = None
 
 for arg in sys.argv[1:]:
     if arg == "--help" or arg == "-h" or arg == "-?":
@@ -67,13 +156,42 @@ for arg in sys.argv[1:]:
         break
     if arg == '--coverage':
         ENABLE_COVERAGE = 1
+    elif SHARD_REGEX.match(arg):
+        shard = tuple(int(n) for n in SHARD_REGEX.match(arg).groups())
+        if not shard[0] < shard[1]:
+            print("Invalid shard %s, must be I/N with 0 <= I < N" % arg)
+            sys.exit(1)
+    elif SHARD_DURATIONS_REGEX.match(arg):
+        shard_durations_file = arg.split(sep='=', maxsplit=1)[1]
+    elif arg == '--merge-durations':
+        merge_durations_files = True
+    elif JUNIT_REGEX.match(arg):
+        junit_file = arg.split(sep='=', maxsplit=1)[1]
+    elif MERGE_JUNIT_REGEX.match(arg):
+        merge_junit_file = arg.split(sep='=', maxsplit=1)[1]
+    elif REPORT_REGEX.match(arg):
+        report_file = arg.split(sep='=', maxsplit=1)[1]
     elif PASSON_REGEX.match(arg):
         passon_args.append(arg)
     elif PARALLEL_REGEX.match(arg):
         run_parallel = int(arg.split(sep='=', maxsplit=1)[1])
+    elif DURATIONS_REGEX.match(arg):
+        durations_file = arg.split(sep='=', maxsplit=1)[1]
     else:
         opts.add(arg)
 
+if merge_junit_file:
+    merge_junit(merge_junit_file, sorted(opts))
+    sys.exit(0)
+
+if merge_durations_files:
+    merge_durations(durations_file, sorted(opts))
+    sys.exit(0)
+
+if shard and shard_durations_file is None:
+    shard_durations_file = os.path.join(os.path.dirname(durations_file),
+                                        "rpc-test-durations-shard-%d-of-%d.json" % shard)
+
 #Set env vars
 if "NAVCOIND" not in os.environ:
     os.environ["NAVCOIND"] = BUILDDIR + '/src/navcoind' + EXEEXT
@@ -101,7 +219,8 @@ if ENABLE_ZMQ:
 
 #Tests
 testScripts = [
-    # longest test should go first, to favor running tests in parallel
+    # Tests run longest first by their recorded durations (see
+    # TestDurations); this order only matters for tests that never ran
    # 'p2p-fullblocktest.py',
 #    'walletbackup.py',
 #    'bip68-112-113-p2p.py',
@@ -158,12 +277,17 @@ testScripts = [
     'cfund-rawtx-proposal-vote.py',
     'cfund-vote.py',
     'reject-version-bit.py',
+    'rpcstream.py',
 
 ]
 #if ENABLE_ZMQ:
 #    testScripts.append('zmq_test.py')
 
 testScriptsExt = [
+    'blockgen.py',
+    'mininode-deserialize.py',
+    'mininode-memory.py',
+    'mininode-throughput.py',
     'bip9-softforks.py',
     'bip65-cltv.py',
     'bip65-cltv-p2p.py',
@@ -213,30 +337,62 @@ def runtests():
     if coverage:
         flags.append(coverage.flag)
 
-    if len(test_list) > 1 and run_parallel > 1:
+    #Run Tests, longest first to favor running them in parallel.  Each
+    #test's port seed is its place in the listed tests, so that shards
+    #running on the same machine don't share ports.
+    all_tests = testScripts + testScriptsExt
+    port_seeds = dict((t, n) for n, t in enumerate(all_tests))
+    cache_port_seed = len(all_tests)
+    durations = TestDurations(durations_file)
+    test_list = durations.longest_first(test_list)
+    if shard:
+        test_list = durations.shards(test_list, shard[1])[shard[0]]
+        cache_port_seed += shard[0]
+        print("Running shard %d/%d: %d tests\n" % (shard[0], shard[1], len(test_list)))
+        # An empty shard still goes on to write its (empty) reports, so
+        # they can be merged with the others
+
+    num_jobs = max_parallel_tests(run_parallel)
+    if len(test_list) > 1 and num_jobs > 1:
         # Populate cache
-        subprocess.check_output([RPC_TESTS_DIR + 'create_cache.py'] + flags)
+        subprocess.check_output([RPC_TESTS_DIR + 'create_cache.py'] + flags + ["--portseed=%d" % cache_port_seed])
 
-    #Run Tests
-    max_len_name = len(max(test_list, key=len))
+    max_len_name = len(max(test_list, key=len, default="TEST"))
     time_sum = 0
     time0 = time.time()
-    job_queue = RPCTestHandler(run_parallel, test_list, flags)
+    report = ResourceReport() if report_file else None
+    job_queue = RPCTestHandler(num_jobs, test_list, flags, [port_seeds[t] for t in test_list],
+                               report.dir if report else None)
+    junit = JUnitReport("rpc-tests" + (" shard %d/%d" % shard if shard else ""))
     results = BOLD[1] + "%s | %s | %s\n\n" % ("TEST".ljust(max_len_name), "PASSED", "DURATION") + BOLD[0]
     all_passed = True
     for _ in range(len(test_list)):
-        (name, stdout, stderr, passed, duration) = job_queue.get_next()
+        (name, stdout, stderr, passed, duration, usage) = job_queue.get_next()
         all_passed = all_passed and passed
+        durations.record(name, duration)
+        junit.add(name, stdout, stderr, passed, duration)
+        if report:
+            report.add(name, passed, duration, usage)
         time_sum += duration
 
         print('\n' + BOLD[1] + name + BOLD[0] + ":")
         print(stdout)
         print('stderr:\n' if not stderr == '' else '', stderr)
-        results += "%s | %s | %s s\n" % (name.ljust(max_len_name), str(passed).ljust(6), duration)
-        print("Pass: %s%s%s, Duration: %s s\n" % (BOLD[1], passed, BOLD[0], duration))
-    results += BOLD[1] + "\n%s | %s | %s s (accumulated)" % ("ALL".ljust(max_len_name), str(all_passed).ljust(6), time_sum) + BOLD[0]
+        results += "%s | %s | %s s\n" % (name.ljust(max_len_name), str(passed).ljust(6), int(duration))
+        print("Pass: %s%s%s, Duration: %s s\n" % (BOLD[1], passed, BOLD[0], int(duration)))
+    results += BOLD[1] + "\n%s | %s | %s s (accumulated)" % ("ALL".ljust(max_len_name), str(all_passed).ljust(6), int(time_sum)) + BOLD[0]
     print(results)
     print("\nRuntime: %s s" % (int(time.time() - time0)))
+    if shard:
+        # Not into durations_file, which the other shards split the tests by
+        save_durations(shard_durations_file, durations.recorded)
+    else:
+        durations.save()
+    if junit_file:
+        junit.write(junit_file, time.time() - time0)
+    if report:
+        report.write(report_file)
+        report.cleanup()
 
     if coverage:
         coverage.report_rpc_coverage()
@@ -247,45 +403,196 @@ def runtests():
     sys.exit(not all_passed)
 
 
+def max_parallel_tests(requested=None):
+    """
+    How many tests to run at once: the number requested, or by default
+    the number of CPUs (at least 4, as the tests spend most of their time
+    waiting), and never more than can get their own ports (see p2p_port in
+    test_framework/util.py).
+    """
+    port_slots = (PORT_RANGE - 1 - MAX_NODES) // MAX_NODES
+    if requested is None:
+        try:
+            cpus = len(os.sched_getaffinity(0))
+        except AttributeError:
+            cpus = os.cpu_count() or 1
+        requested = max(cpus, 4)
+    return max(1, min(requested, port_slots))
+
+
+class TestDurations:
+    """
+    Wall clock duration of each test in previous runs, kept in a JSON file.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.durations = load_durations(filename)
+        self.recorded = {}
+
+    def longest_first(self, test_list):
+        """
+        Sort test_list by decreasing duration.  Tests that never ran go
+        first, in their listed order, as they could be the longest.
+        """
+        return sorted(test_list, key=lambda t: -self.durations.get(t, float('inf')))
+
+    def shards(self, test_list, num_shards):
+        """
+        Split test_list into num_shards lists of about the same total
+        duration: each test, longest first, goes to the shard with the
+        least work so far.  Tests that never ran count as the average.
+        Ties are broken by name and shard number, so every machine gets
+        the same split from the same durations.
+        """
+        known = [self.durations[t] for t in test_list if t in self.durations]
+        default = sum(known) / len(known) if known else 1.0
+        shards = [[] for _ in range(num_shards)]
+        loads = [0.0] * num_shards
+        for t in sorted(test_list, key=lambda t: (-self.durations.get(t, default), t)):
+            n = min(range(num_shards), key=lambda n: (loads[n], n))
+            shards[n].append(t)
+            loads[n] += self.durations.get(t, default)
+        return shards
+
+    def record(self, name, duration):
+        self.recorded[name] = round(duration, 3)
+
+    def save(self):
+        # Another run may have saved its durations since we loaded the file
+        durations = load_durations(self.filename)
+        durations.update(self.recorded)
+        save_durations(self.filename, durations)
+
+
 class RPCTestHandler:
     """
     Trigger the testscrips passed in via the list.
     """
 
-    def __init__(self, num_tests_parallel, test_list=None, flags=None):
+    def __init__(self, num_tests_parallel, test_list=None, flags=None, port_seeds=None, resource_dir=None):
         assert(num_tests_parallel >= 1)
         self.num_jobs = num_tests_parallel
         self.test_list = test_list
         self.flags = flags
+        self.port_seeds = port_seeds
+        # Where tests write their resource usage, if wanted
+        self.resource_dir = resource_dir
         self.num_running = 0
-        self.jobs = []
+        # Finished jobs, put there by the thread waiting for each of them
+        self.finished = queue.Queue()
 
     def get_next(self):
         while self.num_running < self.num_jobs and self.test_list:
             # Add tests
             self.num_running += 1
             t = self.test_list.pop(0)
-            port_seed = ["--portseed=%s" % len(self.test_list)]
-            self.jobs.append((t,
-                              time.time(),
-                              subprocess.Popen((RPC_TESTS_DIR + t).split() + self.flags + port_seed,
-                                               universal_newlines=True,
-                                               stdout=subprocess.PIPE,
-                                               stderr=subprocess.PIPE)))
-        if not self.jobs:
+            if self.port_seeds:
+                seed = self.port_seeds.pop(0)
+            else:
+                seed = len(self.test_list)
+            port_seed = ["--portseed=%s" % seed]
+            resource_file = None
+            if self.resource_dir:
+                resource_file = os.path.join(self.resource_dir, "%s.json" % seed)
+                port_seed.append("--resourcefile=%s" % resource_file)
+            proc = subprocess.Popen((RPC_TESTS_DIR + t).split() + self.flags + port_seed,
+                                    universal_newlines=True,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+            threading.Thread(target=self._wait, args=(t, time.time(), proc, resource_file), daemon=True).start()
+        if not self.num_running:
             raise IndexError('pop from empty list')
         while True:
             # Return first proc that finishes
-            time.sleep(.5)
-            for j in self.jobs:
-                (name, time0, proc) = j
-                if proc.poll() is not None:
-                    (stdout, stderr) = proc.communicate(timeout=3)
-                    passed = stderr == "" and proc.returncode == 0
-                    self.num_running -= 1
-                    self.jobs.remove(j)
-                    return name, stdout, stderr, passed, int(time.time() - time0)
-            print('.', end='', flush=True)
+            try:
+                (name, stdout, stderr, passed, duration, usage) = self.finished.get(timeout=.5)
+            except queue.Empty:
+                print('.', end='', flush=True)
+                continue
+            self.num_running -= 1
+            return name, stdout, stderr, passed, duration, usage
+
+    def _wait(self, name, time0, proc, resource_file):
+        # Reading the output as it comes also keeps a chatty test from
+        # blocking on a full pipe
+        (stdout, stderr) = proc.communicate()
+        duration = time.time() - time0
+        passed = stderr == "" and proc.returncode == 0
+        usage = {}
+        if resource_file:
+            try:
+                with open(resource_file, 'r', encoding='utf8') as f:
+                    usage = json.load(f)
+            except (OSError, ValueError):
+                pass
+        self.finished.put((name, stdout, stderr, passed, duration, usage))
+
+
+class ResourceReport:
+    """
+    Resources used by each test, as written by the tests themselves (see
+    NavCoinTestFramework.write_resource_usage), for comparing builds.
+    """
+
+    # Columns of the CSV report; the JSON one also has the per-navcoind and
+    # per-RPC-method details
+    CSV_FIELDS = ['name', 'passed', 'wall_time', 'cpu_user', 'cpu_system', 'peak_rss_kb',
+                  'rpc_calls', 'navcoinds', 'navcoind_cpu_user', 'navcoind_cpu_system',
+                  'navcoind_peak_rss_kb', 'navcoind_p2p_bytes_sent', 'navcoind_p2p_bytes_recv',
+                  'mininode_bytes_sent', 'mininode_bytes_recv']
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix="resources")
+        self.tests = []
+
+    def add(self, name, passed, duration, usage):
+        test = dict(usage)
+        test.update(name=name, passed=passed, wall_time=round(duration, 3))
+        navcoinds = usage.get('navcoinds', [])
+        test['navcoind_cpu_user'] = sum(n.get('cpu_user', 0) for n in navcoinds)
+        test['navcoind_cpu_system'] = sum(n.get('cpu_system', 0) for n in navcoinds)
+        test['navcoind_peak_rss_kb'] = max([n.get('peak_rss_kb', 0) for n in navcoinds] + [0])
+        test['navcoind_p2p_bytes_sent'] = sum(n.get('p2p_bytes_sent', 0) for n in navcoinds)
+        test['navcoind_p2p_bytes_recv'] = sum(n.get('p2p_bytes_recv', 0) for n in navcoinds)
+        self.tests.append(test)
+
+    def write(self, filename):
+        with open(filename, 'w', encoding='utf8', newline='') as f:
+            if filename.endswith('.csv'):
+                writer = csv.DictWriter(f, self.CSV_FIELDS, extrasaction='ignore')
+                writer.writeheader()
+                for test in self.tests:
+                    writer.writerow(dict(test, navcoinds=len(test.get('navcoinds', []))))
+            else:
+                json.dump(self.tests, f, indent=1, sort_keys=True)
+
+    def cleanup(self):
+        return shutil.rmtree(self.dir)
+
+
+class JUnitReport:
+    """
+    Test results in JUnit XML, as read by most CI servers.
+    """
+
+    def __init__(self, name):
+        self.suite = ET.Element('testsuite', name=name)
+
+    def add(self, name, stdout, stderr, passed, duration):
+        case = ET.SubElement(self.suite, 'testcase', name=name, classname='rpc-tests', time='%.3f' % duration)
+        if not passed:
+            ET.SubElement(case, 'failure', message='%s failed' % name).text = stderr
+        ET.SubElement(case, 'system-out').text = stdout
+        if stderr:
+            ET.SubElement(case, 'system-err').text = stderr
+
+    def write(self, filename, runtime):
+        cases = self.suite.findall('testcase')
+        self.suite.set('tests', str(len(cases)))
+        self.suite.set('failures', str(sum(1 for c in cases if c.find('failure') is not None)))
+        self.suite.set('time', '%.3f' % runtime)
+        ET.ElementTree(self.suite).write(filename, encoding='utf-8', xml_declaration=True)
 
 
 class RPCCoverage(object):
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Navcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+#
+# Test fast_gen and compare its speed to slow_gen
+#
+
+from test_framework.test_framework import NavCoinTestFramework
+from test_framework.util import *
+
+
+class BlockGenTest(NavCoinTestFramework):
+
+    def __init__(self):
+        super().__init__()
+        self.setup_clean_chain = True
+        self.num_nodes = 1
+
+    def add_options(self, parser):
+        parser.add_option("--blocks", dest="blocks", default="100,1000,10000",
+                          help="Comma separated block counts to time (default: %default)")
+
+    def setup_network(self, split=False):
+        self.nodes = start_nodes(self.num_nodes, self.options.tmpdir)
+        self.is_network_split = False
+
+    def timed(self, name, count, gen):
+        height = self.nodes[0].getblockcount()
+        start = time.time()
+        blocks = gen()
+        elapsed = time.time() - start
+        assert_equal(len(blocks), count)
+        assert_equal(self.nodes[0].getblockcount(), height + count)
+        assert_equal(self.nodes[0].getbestblockhash(), blocks[-1])
+        print("%-18s %6d blocks in %7.2fs (%7.0f blocks/s)" % (name, count, elapsed, count / elapsed))
+        return blocks
+
+    def run_test(self):
+        node = self.nodes[0]
+        for count in [int(c) for c in self.options.blocks.split(",")]:
+            self.timed("slow_gen", count, lambda: slow_gen(node, count))
+            self.timed("fast_gen", count, lambda: fast_gen(node, count))
+
+            block_time = node.getblock(node.getbestblockhash())["time"] + 60
+            blocks = self.timed("fast_gen mocktime", count, lambda: fast_gen(node, count, block_time, 60))
+            # Every block has its own time
+            for i in (0, count // 2, count - 1):
+                assert_equal(node.getblock(blocks[i])["time"], block_time + i * 60)
+
+
+if __name__ == '__main__':
+    BlockGenTest().main()
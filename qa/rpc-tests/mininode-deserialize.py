@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Navcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+#
+# Compare deserializing a block from a BytesIO stream with parsing it in
+# place from a buffer (CBlock.from_buffer).
+#
+# A synthetic block of --size MB is deserialized both ways --repeat times
+# and the best time of each is reported.  No navcoind is started.
+#
+
+from test_framework.test_framework import NavCoinTestFramework
+from test_framework.blocktools import create_filler_block_data
+from test_framework.mininode import CBlock
+from test_framework.util import *
+
+from io import BytesIO
+
+
+class MininodeDeserializeTest(NavCoinTestFramework):
+
+    def __init__(self):
+        super().__init__()
+        self.setup_clean_chain = True
+        self.num_nodes = 0
+
+    def add_options(self, parser):
+        parser.add_option("--size", dest="size", default=2, type="int",
+                          help="Size of the block to deserialize in MB (default: %default)")
+        parser.add_option("--repeat", dest="repeat", default=7, type="int",
+                          help="Times to deserialize it each way (default: %default)")
+
+    def setup_network(self, split=False):
+        self.nodes = []
+        self.is_network_split = False
+
+    def timed(self, name, deserialize):
+        best = float('inf')
+        for i in range(self.options.repeat):
+            start = time.time()
+            block = deserialize()
+            best = min(best, time.time() - start)
+        print("%-20s %.3fs" % (name, best))
+        return block
+
+    def run_test(self):
+        data = create_filler_block_data(self.options.size * 1000000)
+
+        def from_stream():
+            block = CBlock()
+            block.deserialize(BytesIO(data))
+            return block
+
+        def from_buffer():
+            block, offset = CBlock.from_buffer(data)
+            assert_equal(offset, len(data))
+            return block
+
+        print("block: %d bytes, best of %d" % (len(data), self.options.repeat))
+        stream_block = self.timed("BytesIO deserialize", from_stream)
+        buffer_block = self.timed("from_buffer", from_buffer)
+        assert_equal(len(buffer_block.vtx), len(stream_block.vtx))
+        assert_equal(buffer_block.serialize(), data)
+
+
+if __name__ == '__main__':
+    MininodeDeserializeTest().main()
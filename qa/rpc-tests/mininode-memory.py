@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Navcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+#
+# Measure the memory mininode uses to hold a large deserialized block.
+#
+# A synthetic block of --size MB is loaded with CBlock.deserialize, and the
+# resident set size before and after loading, and its peak while loading,
+# are read from /proc (Linux only).  No navcoind is started.  To compare
+# with another version of mininode, run it with that version's
+# test_framework/mininode.py.
+#
+
+from test_framework.test_framework import NavCoinTestFramework
+from test_framework.blocktools import create_filler_block_data
+from test_framework.mininode import CBlock
+from test_framework.util import *
+
+from io import BytesIO
+import gc
+
+
+def read_memory_status():
+    """Current (VmRSS) and peak (VmHWM) resident set size, in kB"""
+    status = {}
+    with open("/proc/self/status", encoding="utf8") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                status[key] = int(value.split()[0])
+    return status
+
+def reset_peak_rss():
+    """Reset VmHWM to the current RSS; False if the kernel won't let us"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class MininodeMemoryTest(NavCoinTestFramework):
+
+    def __init__(self):
+        super().__init__()
+        self.setup_clean_chain = True
+        self.num_nodes = 0
+
+    def add_options(self, parser):
+        parser.add_option("--size", dest="size", default=32, type="int",
+                          help="Size of the block to load in MB (default: %default)")
+
+    def setup_network(self, split=False):
+        self.nodes = []
+        self.is_network_split = False
+
+    def run_test(self):
+        if not os.path.exists("/proc/self/status"):
+            print("Skipping: resident set size is read from /proc")
+            return
+
+        data = create_filler_block_data(self.options.size * 1000000)
+        gc.collect()
+        peak_reset = reset_peak_rss()
+        before = read_memory_status()
+
+        start = time.time()
+        block = CBlock()
+        block.deserialize(BytesIO(data))
+        elapsed = time.time() - start
+        after = read_memory_status()
+
+        print("block:    %d bytes, %d transactions" % (len(data), len(block.vtx)))
+        print("load:     %.2fs" % elapsed)
+        print("resident: %d MB before, %d MB after (+%d MB)"
+              % (before["VmRSS"] // 1024, after["VmRSS"] // 1024,
+                 (after["VmRSS"] - before["VmRSS"]) // 1024))
+        if peak_reset:
+            print("peak:     %d MB while loading" % (after["VmHWM"] // 1024))
+        else:
+            print("peak:     %d MB, including building the block (VmHWM could not be reset)"
+                  % (after["VmHWM"] // 1024))
+
+        assert_equal(block.serialize(), data)
+
+
+if __name__ == '__main__':
+    MininodeMemoryTest().main()
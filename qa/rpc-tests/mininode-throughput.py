@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Navcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+#
+# Measure how fast a NodeConn streams max-size blocks over loopback.
+#
+# The peer is a plain socket server in a separate process, so it doesn't
+# compete with the network thread for the GIL.  No navcoind is started.
+#
+# Receiving is timed with two receive buffers, to tell them and the debug
+# logging apart:
+# - cursor:  NodeConn as it is
+# - legacy:  NodeConn reading 8 kB at a time into a bytes buffer that is
+#            grown by concatenation and re-sliced after every message, as
+#            it did before the cursor-based buffer
+# each with the blocks parsed into CBlocks and left unparsed (raw), and
+# with debug logging disabled unless "debug" is shown.  Sending is timed
+# with debug logging disabled and enabled; its buffering is up to the
+# asyncio transport.
+#
+
+from test_framework.test_framework import NavCoinTestFramework
+from test_framework.blocktools import create_filler_block_data
+from test_framework.mininode import *
+from test_framework.util import *
+
+import multiprocessing
+import socket
+
+
+def p2p_message(command, payload):
+    checksum = hash256(payload)[:4]
+    return struct.pack("<4s12sI4s", NodeConn.MAGIC_BYTES["regtest"], command,
+                       len(payload), checksum) + payload
+
+def run_peer(listener, send_data, count, recv_blocks):
+    """
+    Serve one connection on listener: send send_data count times, then
+    answer with a pong once recv_blocks block messages were received,
+    until the connection is closed.
+    """
+    conn, _ = listener.accept()
+    listener.close()
+    for i in range(count):
+        conn.sendall(send_data)
+
+    buf = bytearray()
+    blocks = 0
+    while True:
+        data = conn.recv(1 << 20)
+        if not data:
+            conn.close()
+            return
+        buf += data
+        while len(buf) >= 24:
+            msglen = struct.unpack_from("<I", buf, 16)[0]
+            if len(buf) < 24 + msglen:
+                break
+            if buf[4:16].rstrip(b"\x00") == b"block":
+                blocks += 1
+                if blocks == recv_blocks:
+                    conn.sendall(p2p_message(b"pong", struct.pack("<Q", 0)))
+            del buf[:24 + msglen]
+
+
+class msg_raw_block(msg_generic):
+    """A block message whose payload is kept as received"""
+
+    def __init__(self):
+        super().__init__(b"block")
+
+    def deserialize(self, f):
+        self.data = f.read()
+
+RAW_MESSAGEMAP = dict(NodeConn.messagemap)
+RAW_MESSAGEMAP[b"block"] = msg_raw_block
+
+
+class LegacyBufferNodeConn(NodeConn):
+    """NodeConn receiving the way it did before the cursor-based buffer"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.legacy_chunk = bytearray(8192)
+        self.legacy_buf = b""
+
+    def get_buffer(self, sizehint):
+        return self.legacy_chunk
+
+    def buffer_updated(self, nbytes):
+        self.legacy_buf += bytes(self.legacy_chunk[:nbytes])
+        self.recvbuf = self.legacy_buf
+        self.recv_start = 0
+        self.recv_end = len(self.legacy_buf)
+        self.got_data()
+        self.legacy_buf = self.recvbuf[self.recv_start:self.recv_end]
+
+
+class CountingNodeConnCB(NodeConnCB):
+    def __init__(self):
+        NodeConnCB.__init__(self, own_lock=True)
+        self.blocks = 0
+        self.pong_received = False
+
+    def on_block(self, conn, message):
+        self.blocks += 1
+
+    def on_pong(self, conn, message):
+        self.pong_received = True
+
+
+class MininodeThroughputTest(NavCoinTestFramework):
+
+    def __init__(self):
+        super().__init__()
+        self.setup_clean_chain = True
+        self.num_nodes = 0
+
+    def add_options(self, parser):
+        parser.add_option("--blocks", dest="blocks", default=1000, type="int",
+                          help="Number of max-size blocks to stream each way (default: %default)")
+
+    def setup_network(self, split=False):
+        self.nodes = []
+        self.is_network_split = False
+
+    def stream(self, name, conn_class, debug, send_data=b"", count=0, send_block=None, parse=True):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        port = listener.getsockname()[1]
+        recv_blocks = self.options.blocks if send_block is not None else 0
+        peer = multiprocessing.Process(target=run_peer, args=(listener, send_data, count, recv_blocks))
+        peer.start()
+        listener.close()
+
+        callback = CountingNodeConnCB()
+        start = time.time()
+        conn = conn_class("127.0.0.1", port, None, callback)
+        if not parse:
+            conn.messagemap = dict(RAW_MESSAGEMAP)
+        if debug:
+            conn.log.setLevel(logging.DEBUG)
+            conn.log.addHandler(logging.FileHandler(os.devnull))
+            conn.log.propagate = False
+        network_thread = NetworkThread()
+        network_thread.start()
+        if send_block is None:
+            wait_until(lambda: callback.blocks == count, cond=callback.cond)
+        else:
+            wait_until(lambda: conn.state == "connected", cond=callback.cond)
+            for i in range(self.options.blocks):
+                conn.send_message(msg_block(send_block))
+            wait_until(lambda: callback.pong_received, cond=callback.cond)
+        elapsed = time.time() - start
+
+        conn.disconnect_node()
+        network_thread.join()
+        peer.join()
+        assert_equal(peer.exitcode, 0)
+        print("%-8s %-4s %-6s %5d blocks in %6.2fs (%6.1f MB/s)" % (name, "" if parse else "raw",
+              "debug" if debug else "", self.options.blocks, elapsed,
+              self.options.blocks * MAX_BLOCK_SIZE / elapsed / 1e6))
+
+    def run_test(self):
+        data = create_filler_block_data(MAX_BLOCK_SIZE)
+        message = p2p_message(b"block", data)
+        count = self.options.blocks
+
+        print("receive:")
+        self.stream("cursor", NodeConn, False, message, count, parse=False)
+        self.stream("legacy", LegacyBufferNodeConn, False, message, count, parse=False)
+        self.stream("cursor", NodeConn, False, message, count)
+        self.stream("legacy", LegacyBufferNodeConn, False, message, count)
+        self.stream("cursor", NodeConn, True, message, count)
+
+        block = CBlock()
+        block.deserialize(BytesIO(data))
+        print("send:")
+        self.stream("cursor", NodeConn, False, send_block=block)
+        self.stream("cursor", NodeConn, True, send_block=block)
+
+
+if __name__ == '__main__':
+    MininodeThroughputTest().main()
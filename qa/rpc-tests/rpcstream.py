@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Navcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+#
+# Test AuthServiceProxy.stream against a local JSON-RPC server whose
+# responses end exactly on the boundaries of JSONStreamReader's chunks,
+# so the trailing newline is only read when the response is drained.
+#
+
+from test_framework.test_framework import NavCoinTestFramework
+from test_framework.util import *
+from test_framework.authproxy import AuthServiceProxy, JSONStreamReader
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class StreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf8'))
+        if request['method'] == 'padded':
+            # A result padded so that the closing brace of the response is
+            # the last byte of the requested number of chunks
+            length = request['params'][0]
+            response = json.dumps({'result': [''], 'error': None, 'id': request['id']})
+            padding = length - len(response)
+            response = json.dumps({'result': ['x' * padding], 'error': None, 'id': request['id']})
+            assert_equal(len(response), length)
+        else:
+            response = json.dumps({'result': request['params'], 'error': None, 'id': request['id']})
+        body = (response + '\n').encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StreamServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class RPCStreamTest(NavCoinTestFramework):
+
+    def __init__(self):
+        super().__init__()
+        self.setup_clean_chain = True
+        self.num_nodes = 0
+
+    def setup_network(self, split=False):
+        self.nodes = []
+        self.server = StreamServer(('127.0.0.1', rpc_port(0)), StreamHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://rt:rt@127.0.0.1:%d" % rpc_port(0)
+
+    def check_boundaries(self, proxy):
+        for chunks in (1, 2):
+            length = chunks * JSONStreamReader.CHUNK_SIZE
+            result = list(proxy.padded.stream(length))
+            assert_equal(len(result), 1)
+            # The connection is still usable, for calls and streams alike
+            assert_equal(proxy.echo(1, 2), [1, 2])
+            assert_equal(list(proxy.echo.stream(3, 4)), [3, 4])
+            assert_equal(proxy.echo(5), [5])
+
+    def run_test(self):
+        self.check_boundaries(AuthServiceProxy(self.url))
+        self.check_boundaries(AuthServiceProxy(self.url, pool_size=2))
+        self.server.shutdown()
+
+
+if __name__ == '__main__':
+    RPCStreamTest().main()
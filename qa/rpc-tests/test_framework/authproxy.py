@@ -9,10 +9,19 @@
     (if server supports HTTP/1.1)
   - sends protocol 'version', per JSON-RPC 1.1
   - sends proper, incrementing 'id'
+  - optionally keeps a pool of HTTP connections (pool_size), so one proxy
+    can be shared by many threads making calls in parallel
+  - batches calls into JSON-RPC batch requests (batch())
+  - can stream the elements of large array/object results as they are
+    received (proxy.method.stream(*args))
+
   - sends Basic HTTP authentication headers
   - parses all JSON numbers that look like floats as Decimal
   - uses standard Python json lib
 
+  AsyncAuthServiceProxy offers the same calls as coroutines
+  (await proxy.method(*args)), pipelined over one persistent connection.
+
   Previous copyright, from python-jsonrpc/jsonrpc/proxy.py:
 
   Copyright (c) 2007 Jan-Klaas Kollhof
@@ -38,10 +47,16 @@ try:
     import http.client as httplib
 except ImportError:
     import httplib
+import asyncio
 import base64
+import codecs
+import collections
 import decimal
+import itertools
 import json
 import logging
+import threading
+from contextlib import contextmanager
 try:
     import urllib.parse as urlparse
 except ImportError:
@@ -51,8 +66,16 @@ USER_AGENT = "AuthServiceProxy/0.1"
 
 HTTP_TIMEOUT = 30
 
+# Limits on the size of a single JSON-RPC batch request (see
+# AuthServiceProxy.batch); larger batches are split.
+BATCH_MAX_CALLS = 10000
+BATCH_MAX_BYTES = 1 << 20
+
 log = logging.getLogger("NavCoinRPC")
 
+# JSON-RPC request ids, shared by all proxies (next() on it is thread-safe)
+_id_counter = itertools.count(1)
+
 class JSONRPCException(Exception):
     def __init__(self, rpc_error):
         Exception.__init__(self)
@@ -64,11 +87,75 @@ def EncodeDecimal(o):
         return str(o)
     raise TypeError(repr(o) + " is not JSON serializable")
 
-class AuthServiceProxy(object):
-    __id_count = 0
+def basic_auth_header(url):
+    '''
+    The Authorization header for the credentials in a parsed URL.
+    '''
+    (user, passwd) = (url.username, url.password)
+    try:
+        user = user.encode('utf8')
+    except AttributeError:
+        pass
+    try:
+        passwd = passwd.encode('utf8')
+    except AttributeError:
+        pass
+    authpair = user + b':' + passwd
+    return b'Basic ' + base64.b64encode(authpair)
+
+class HTTPConnectionPool(object):
+    '''
+    Up to size keep-alive connections to one server, handed out to one thread
+    at a time.  acquire() reuses an idle connection, opens a new one while
+    fewer than size exist, and otherwise blocks until one is released.
+    '''
+    def __init__(self, connection_factory, size):
+        self.connection_factory = connection_factory
+        self.size = size
+        self.idle = []
+        self.count = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while not self.idle and self.count >= self.size:
+                self.cond.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.count += 1
+        try:
+            return self.connection_factory()
+        except:
+            self.discard(None)
+            raise
+
+    def release(self, conn):
+        with self.cond:
+            self.idle.append(conn)
+            self.cond.notify()
+
+    # Drop a connection that is broken or in an unknown state
+    def discard(self, conn):
+        if conn is not None:
+            conn.close()
+        with self.cond:
+            self.count -= 1
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            for conn in self.idle:
+                conn.close()
+            self.count -= len(self.idle)
+            self.idle = []
 
+class AuthServiceProxy(object):
     # ensure_ascii: escape unicode as \uXXXX, passed to json.dumps
-    def __init__(self, service_url, service_name=None, timeout=HTTP_TIMEOUT, connection=None, ensure_ascii=True):
+    # pool_size: if set, make calls over a pool of up to this many
+    #     connections, so the proxy (and the proxies it hands out for methods)
+    #     can be used from several threads at once; by default all calls go
+    #     over a single connection and must not overlap.
+    def __init__(self, service_url, service_name=None, timeout=HTTP_TIMEOUT, connection=None, ensure_ascii=True, pool_size=None, pool=None):
         self.__service_url = service_url
         self._service_name = service_name
         self.ensure_ascii = ensure_ascii # can be toggled on the fly by tests
@@ -77,27 +164,27 @@ class AuthServiceProxy(object):
             port = 80
         else:
             port = self.__url.port
-        (user, passwd) = (self.__url.username, self.__url.password)
-        try:
-            user = user.encode('utf8')
-        except AttributeError:
-            pass
-        try:
-            passwd = passwd.encode('utf8')
-        except AttributeError:
-            pass
-        authpair = user + b':' + passwd
-        self.__auth_header = b'Basic ' + base64.b64encode(authpair)
+        self.__auth_header = basic_auth_header(self.__url)
 
-        if connection:
+        if self.__url.scheme == 'https':
+            connection_class = httplib.HTTPSConnection
+        else:
+            connection_class = httplib.HTTPConnection
+        def new_connection():
+            return connection_class(self.__url.hostname, port, timeout=timeout)
+
+        self.__conn = None
+        self.__pool = None
+        if pool:
+            # Callables re-use the pool of the original proxy
+            self.__pool = pool
+        elif connection:
             # Callables re-use the connection of the original proxy
             self.__conn = connection
-        elif self.__url.scheme == 'https':
-            self.__conn = httplib.HTTPSConnection(self.__url.hostname, port,
-                                                  timeout=timeout)
+        elif pool_size:
+            self.__pool = HTTPConnectionPool(new_connection, pool_size)
         else:
-            self.__conn = httplib.HTTPConnection(self.__url.hostname, port,
-                                                 timeout=timeout)
+            self.__conn = new_connection()
 
     def __getattr__(self, name):
         if name.startswith('__') and name.endswith('__'):
@@ -105,43 +192,68 @@ class AuthServiceProxy(object):
             raise AttributeError
         if self._service_name is not None:
             name = "%s.%s" % (self._service_name, name)
-        return AuthServiceProxy(self.__service_url, name, connection=self.__conn)
+        return AuthServiceProxy(self.__service_url, name, connection=self.__conn, pool=self.__pool)
 
     def _request(self, method, path, postdata):
+        with self._connection() as conn:
+            return self._get_response(self._request_on(conn, method, path, postdata))
+
+    # The connection to make a request on, taken from the pool if there is
+    # one
+    @contextmanager
+    def _connection(self):
+        if self.__pool is None:
+            yield self.__conn
+            return
+        conn = self.__pool.acquire()
+        try:
+            yield conn
+        except:
+            # The connection may be mid-response; don't hand it out again
+            self.__pool.discard(conn)
+            raise
+        self.__pool.release(conn)
+
+    def _request_on(self, conn, method, path, postdata):
         '''
         Do a HTTP request, with retry if we get disconnected (e.g. due to a timeout).
         This is a workaround for https://bugs.python.org/issue3566 which is fixed in Python 3.5.
+        Returns the HTTP response, with its body not read yet.
         '''
         headers = {'Host': self.__url.hostname,
                    'User-Agent': USER_AGENT,
                    'Authorization': self.__auth_header,
                    'Content-type': 'application/json'}
         try:
-            self.__conn.request(method, path, postdata, headers)
-            return self._get_response()
+            conn.request(method, path, postdata, headers)
+            return self._get_http_response(conn)
         except httplib.BadStatusLine as e:
             if e.line == "''": # if connection was closed, try again
-                self.__conn.close()
-                self.__conn.request(method, path, postdata, headers)
-                return self._get_response()
+                conn.close()
+                conn.request(method, path, postdata, headers)
+                return self._get_http_response(conn)
             else:
                 raise
         except BrokenPipeError:
             # Python 3.5+ raises this instead of BadStatusLine when the connection was reset
-            self.__conn.close()
-            self.__conn.request(method, path, postdata, headers)
-            return self._get_response()
+            conn.close()
+            conn.request(method, path, postdata, headers)
+            return self._get_http_response(conn)
 
-    def __call__(self, *args):
-        AuthServiceProxy.__id_count += 1
+    def _call_postdata(self, args):
+        id_count = next(_id_counter)
 
-        log.debug("-%s-> %s %s"%(AuthServiceProxy.__id_count, self._service_name,
-                                 json.dumps(args, default=EncodeDecimal, ensure_ascii=self.ensure_ascii)))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("-%s-> %s %s"%(id_count, self._service_name,
+                                     json.dumps(args, default=EncodeDecimal, ensure_ascii=self.ensure_ascii)))
         postdata = json.dumps({'version': '1.1',
                                'method': self._service_name,
                                'params': args,
-                               'id': AuthServiceProxy.__id_count}, default=EncodeDecimal, ensure_ascii=self.ensure_ascii)
-        response = self._request('POST', self.__url.path, postdata.encode('utf-8'))
+                               'id': id_count}, default=EncodeDecimal, ensure_ascii=self.ensure_ascii)
+        return postdata.encode('utf-8')
+
+    def __call__(self, *args):
+        response = self._request('POST', self.__url.path, self._call_postdata(args))
         if response['error'] is not None:
             raise JSONRPCException(response['error'])
         elif 'result' not in response:
@@ -150,13 +262,52 @@ class AuthServiceProxy(object):
         else:
             return response['result']
 
+    def stream(self, *args):
+        '''
+        Like calling the method, but for results that are arrays (objects):
+        return an iterator over the elements ((key, value) pairs), which are
+        parsed as the response is read instead of after all of it was
+        received.  The connection is in use until the iterator is exhausted
+        or closed.
+        '''
+        postdata = self._call_postdata(args)
+        with self._connection() as conn:
+            try:
+                http_response = self._request_on(conn, 'POST', self.__url.path, postdata)
+                for item in JSONStreamReader(http_response).iter_result():
+                    yield item
+                # Whitespace after the response object (e.g. the final
+                # newline) may not have been read yet; finish the response
+                # so the connection can take the next request
+                http_response.read()
+            except:
+                # Stopped mid-response; the connection can't be reused
+                conn.close()
+                raise
+
+    def batch(self, max_calls=BATCH_MAX_CALLS, max_bytes=BATCH_MAX_BYTES):
+        '''
+        Return an AuthServiceProxyBatch that queues calls made on it and
+        sends them in as few JSON-RPC batch requests as possible:
+
+            with node.batch() as b:
+                calls = [b.getblockhash(h) for h in range(100000)]
+            hashes = [c.result() for c in calls]
+
+        or, equivalently, hashes = b.execute() inside the with block.
+        '''
+        return AuthServiceProxyBatch(self, max_calls, max_bytes)
+
     def _batch(self, rpc_call_list):
         postdata = json.dumps(list(rpc_call_list), default=EncodeDecimal, ensure_ascii=self.ensure_ascii)
-        log.debug("--> "+postdata)
+        log.debug("--> %s", postdata)
+        return self._post(postdata)
+
+    def _post(self, postdata):
         return self._request('POST', self.__url.path, postdata.encode('utf-8'))
 
-    def _get_response(self):
-        http_response = self.__conn.getresponse()
+    def _get_http_response(self, conn):
+        http_response = conn.getresponse()
         if http_response is None:
             raise JSONRPCException({
                 'code': -342, 'message': 'missing HTTP response from server'})
@@ -165,11 +316,388 @@ class AuthServiceProxy(object):
         if content_type != 'application/json':
             raise JSONRPCException({
                 'code': -342, 'message': 'non-JSON HTTP response with \'%i %s\' from server' % (http_response.status, http_response.reason)})
+        return http_response
 
-        responsedata = http_response.read().decode('utf8')
-        response = json.loads(responsedata, parse_float=decimal.Decimal)
-        if "error" in response and response["error"] is None:
-            log.debug("<-%s- %s"%(response["id"], json.dumps(response["result"], default=EncodeDecimal, ensure_ascii=self.ensure_ascii)))
-        else:
-            log.debug("<-- "+responsedata)
+    def _get_response(self, http_response):
+        responsedata = http_response.read()
+        response = json.loads(responsedata.decode('utf8'), parse_float=decimal.Decimal)
+        # Re-serializing a big result just to drop the log line is expensive
+        if log.isEnabledFor(logging.DEBUG):
+            if "error" in response and response["error"] is None:
+                log.debug("<-%s- %s"%(response["id"], json.dumps(response["result"], default=EncodeDecimal, ensure_ascii=self.ensure_ascii)))
+            else:
+                log.debug("<-- "+responsedata.decode('utf8'))
         return response
+
+class JSONStreamReader(object):
+    '''
+    Incremental parser for a JSON-RPC response read from a file-like object
+    (e.g. an HTTP response), which yields the elements of the result as they
+    are read, so the whole response never has to be in memory at once.
+    Values are parsed with the standard json decoder, one element at a
+    time.
+    '''
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, f):
+        self.f = f
+        self.decoder = json.JSONDecoder(parse_float=decimal.Decimal)
+        self.utf8 = codecs.getincrementaldecoder('utf8')()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    # Read more data, dropping what was parsed already
+    def fill(self):
+        data = self.f.read(self.CHUNK_SIZE)
+        self.buf = self.buf[self.pos:] + self.utf8.decode(data, not data)
+        self.pos = 0
+        self.eof = not data
+
+    # Return the next non-whitespace character (without consuming it), or
+    # '' at the end of the input
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos+1]
+            self.fill()
+
+    def expect(self, chars):
+        c = self.peek()
+        if c == '' or c not in chars:
+            raise ValueError("Expected one of %r in JSON-RPC response, got %r" % (chars, c))
+        self.pos += 1
+        return c
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if self.eof:
+                    raise
+                self.fill()
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end < len(self.buf) or self.eof:
+                self.pos = end
+                return value
+            self.fill()
+
+    # Yield the elements of an array, or the (key, value) pairs of an object
+    def iter_container(self):
+        close = ']' if self.expect('[{') == '[' else '}'
+        if self.peek() == close:
+            self.pos += 1
+            return
+        while True:
+            if close == '}':
+                key = self.value()
+                self.expect(':')
+                yield (key, self.value())
+            else:
+                yield self.value()
+            if self.expect(',' + close) == close:
+                return
+
+    def iter_result(self):
+        response = {}
+        self.expect('{')
+        while self.peek() != '}':
+            key = self.value()
+            self.expect(':')
+            if key == 'result' and self.peek() in '[{':
+                for item in self.iter_container():
+                    yield item
+                response[key] = []
+            else:
+                response[key] = self.value()
+            if self.expect(',}') == '}':
+                break
+        if response.get('error') is not None:
+            raise JSONRPCException(response['error'])
+        elif 'result' not in response:
+            raise JSONRPCException({
+                'code': -343, 'message': 'missing JSON-RPC result'})
+
+class BatchedCall(object):
+    '''
+    A call queued in an AuthServiceProxyBatch.  result() returns its result
+    once the batch was sent, or raises JSONRPCException if it failed.
+    '''
+    def __init__(self, method, params):
+        self.method = method
+        self.params = params
+        self.done = False
+        self.value = None
+        self.error = None
+
+    def set_response(self, response):
+        self.done = True
+        if response is None:
+            self.error = {'code': -343, 'message': 'missing JSON-RPC response in batch'}
+        elif response.get('error') is not None:
+            self.error = response['error']
+        elif 'result' not in response:
+            self.error = {'code': -343, 'message': 'missing JSON-RPC result'}
+        else:
+            self.value = response['result']
+
+    def result(self):
+        if not self.done:
+            raise RuntimeError("%s called before the batch was executed" % self.method)
+        if self.error is not None:
+            raise JSONRPCException(self.error)
+        return self.value
+
+
+class AuthServiceProxyBatch(object):
+    '''
+    Calls made on this object (batch.method(*args)) are queued as
+    BatchedCalls and sent by send() (or on leaving a with block) as
+    JSON-RPC batch requests of at most max_calls calls and max_bytes bytes.
+    Calls are executed by the server in the order they were made; errors
+    of individual calls are raised by their BatchedCall's result().
+    '''
+    def __init__(self, proxy, max_calls=BATCH_MAX_CALLS, max_bytes=BATCH_MAX_BYTES):
+        self._proxy = proxy
+        self._max_calls = max_calls
+        self._max_bytes = max_bytes
+        self._calls = []
+        # Called with the list of methods of each batch request sent
+        self.on_execute = None
+
+    def __getattr__(self, name):
+        if name.startswith('__') and name.endswith('__'):
+            # Python internal stuff
+            raise AttributeError
+        def queue_call(*args):
+            call = BatchedCall(name, args)
+            self._calls.append(call)
+            return call
+        return queue_call
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+
+    def execute(self):
+        '''
+        Send all queued calls and return their results in order, raising
+        JSONRPCException for the first call that failed.
+        '''
+        return [call.result() for call in self.send()]
+
+    def send(self):
+        '''
+        Send all queued calls and return their BatchedCalls.
+        '''
+        calls, self._calls = self._calls, []
+        start = 0
+        while start < len(calls):
+            # Serialize each request separately to split by size
+            ids = []
+            requests = []
+            size = 2
+            end = start
+            while end < len(calls) and end - start < self._max_calls:
+                call = calls[end]
+                id_count = next(_id_counter)
+                request = json.dumps({'version': '1.1',
+                                      'method': call.method,
+                                      'params': call.params,
+                                      'id': id_count},
+                                     default=EncodeDecimal, ensure_ascii=self._proxy.ensure_ascii)
+                if requests and size + len(request) + 1 > self._max_bytes:
+                    break
+                ids.append(id_count)
+                requests.append(request)
+                size += len(request) + 1
+                end += 1
+            postdata = "[" + ",".join(requests) + "]"
+            log.debug("--> %s", postdata)
+            responses = self._proxy._post(postdata)
+            if not isinstance(responses, list):
+                raise JSONRPCException(responses.get('error') or {
+                    'code': -342, 'message': 'non-batch response to batch request'})
+            by_id = dict((r.get('id'), r) for r in responses)
+            for call, id_count in zip(calls[start:end], ids):
+                call.set_response(by_id.get(id_count))
+            if self.on_execute is not None:
+                self.on_execute([call.method for call in calls[start:end]])
+            start = end
+        return calls
+
+class AsyncHTTPConnection(object):
+    '''
+    A persistent HTTP/1.1 client connection for asyncio.  Requests are written
+    as soon as they are made, without waiting for earlier responses
+    (pipelining); a single reader task reads the responses in order and
+    hands each to its request.  The connection is (re)opened on demand.
+    '''
+    def __init__(self, host, port, ssl=None):
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.reader = None
+        self.writer = None
+        self.connecting = None
+        # Futures of the requests sent, in order, waiting for their response
+        self.pending = collections.deque()
+        self.reader_task = None
+
+    async def connect(self):
+        # Only one coroutine opens the connection; the others wait for it
+        if self.connecting is None:
+            self.connecting = asyncio.ensure_future(
+                asyncio.open_connection(self.host, self.port, ssl=self.ssl))
+        connecting = self.connecting
+        try:
+            self.reader, self.writer = await connecting
+        finally:
+            if self.connecting is connecting:
+                self.connecting = None
+
+    async def request(self, method, path, body, headers):
+        if self.writer is None:
+            await self.connect()
+        lines = ['%s %s HTTP/1.1' % (method, path),
+                 'Content-Length: %d' % len(body)]
+        lines.extend('%s: %s' % (k, v.decode('ascii') if isinstance(v, bytes) else v)
+                     for k, v in headers.items())
+        future = asyncio.get_event_loop().create_future()
+        self.pending.append(future)
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8') + body)
+        if self.reader_task is None:
+            self.reader_task = asyncio.ensure_future(self.read_responses())
+        return await future
+
+    async def read_responses(self):
+        try:
+            while self.pending:
+                response = await self.read_response()
+                future = self.pending.popleft()
+                if not future.done():
+                    future.set_result(response)
+        except Exception as e:
+            # The connection is unusable: fail everything still waiting
+            self.close()
+            while self.pending:
+                future = self.pending.popleft()
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.reader_task = None
+
+    # Return (status, reason, headers, body) of the next response
+    async def read_response(self):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed by server")
+        version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await self.reader.readline()
+                    break
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readline()
+            body = b"".join(chunks)
+        else:
+            body = await self.reader.readexactly(int(headers.get('content-length', 0)))
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return int(status), reason, headers, body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+
+
+class AsyncAuthServiceProxy(object):
+    '''
+    asyncio counterpart of AuthServiceProxy.  Calls are coroutines:
+
+        count = await proxy.getblockcount()
+
+    Proxies for methods share their parent's connection, so concurrent calls
+    (e.g. with asyncio.gather) are pipelined over it.  A proxy must only be
+    used from one event loop.
+    '''
+    def __init__(self, service_url, service_name=None, timeout=HTTP_TIMEOUT, connection=None, ensure_ascii=True):
+        self._service_url = service_url
+        self._service_name = service_name
+        self.timeout = timeout
+        self.ensure_ascii = ensure_ascii
+        self._url = urlparse.urlparse(service_url)
+        self._auth_header = basic_auth_header(self._url)
+        if connection:
+            # Callables re-use the connection of the original proxy
+            self._conn = connection
+        else:
+            port = self._url.port
+            if port is None:
+                port = 80
+            self._conn = AsyncHTTPConnection(self._url.hostname, port,
+                                             ssl=(self._url.scheme == 'https') or None)
+
+    def __getattr__(self, name):
+        if name.startswith('__') and name.endswith('__'):
+            # Python internal stuff
+            raise AttributeError
+        if self._service_name is not None:
+            name = "%s.%s" % (self._service_name, name)
+        return AsyncAuthServiceProxy(self._service_url, name, self.timeout,
+                                     connection=self._conn, ensure_ascii=self.ensure_ascii)
+
+    async def __call__(self, *args):
+        id_count = next(_id_counter)
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("-%s-> %s %s"%(id_count, self._service_name,
+                                     json.dumps(args, default=EncodeDecimal, ensure_ascii=self.ensure_ascii)))
+        postdata = json.dumps({'version': '1.1',
+                               'method': self._service_name,
+                               'params': args,
+                               'id': id_count}, default=EncodeDecimal, ensure_ascii=self.ensure_ascii)
+        headers = {'Host': self._url.hostname,
+                   'User-Agent': USER_AGENT,
+                   'Authorization': self._auth_header,
+                   'Content-type': 'application/json'}
+        status, reason, http_headers, responsedata = await asyncio.wait_for(
+            self._conn.request('POST', self._url.path or '/', postdata.encode('utf-8'), headers),
+            self.timeout)
+
+        if http_headers.get('content-type') != 'application/json':
+            raise JSONRPCException({
+                'code': -342, 'message': 'non-JSON HTTP response with \'%i %s\' from server' % (status, reason)})
+        response = json.loads(responsedata.decode('utf8'), parse_float=decimal.Decimal)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("<-- "+responsedata.decode('utf8'))
+        if response.get('error') is not None:
+            raise JSONRPCException(response['error'])
+        elif 'result' not in response:
+            raise JSONRPCException({
+                'code': -343, 'message': 'missing JSON-RPC result'})
+        else:
+            return response['result']
+
+    def close(self):
+        self._conn.close()
@@ -5,7 +5,6 @@
 #
 
 from .mininode import *
-from io import BytesIO
 import dbm.ndbm
 
 class BlockStore(object):
@@ -34,9 +33,7 @@ class BlockStore(object):
         ret = None
         serialized_block = self.get(blockhash)
         if serialized_block is not None:
-            f = BytesIO(serialized_block)
-            ret = CBlock()
-            ret.deserialize(f)
+            ret = CBlock.from_buffer(serialized_block)[0]
             ret.calc_sha256()
         return ret
 
@@ -138,9 +135,7 @@ class TxStore(object):
         ret = None
         serialized_tx = self.get(txhash)
         if serialized_tx is not None:
-            f = BytesIO(serialized_tx)
-            ret = CTransaction()
-            ret.deserialize(f)
+            ret = CTransaction.from_buffer(serialized_tx)[0]
             ret.calc_sha256()
         return ret
 
@@ -22,6 +22,23 @@ def create_block(hashprev, coinbase, nTime=None):
     block.calc_sha256()
     return block
 
+# Serialize a block of about size bytes for benchmarks: a coinbase followed
+# by as many distinct two-in, two-out transactions as fit.  The
+# transactions spend made-up outputs and the merkle root only covers the
+# coinbase, so the block is not valid.
+def create_filler_block_data(size, hashprev=0):
+    block = create_block(hashprev, create_coinbase(1))
+    tx = CTransaction()
+    tx.vin = [CTxIn(COutPoint(0, n), b"\x00" * 107, 0xffffffff) for n in range(2)]
+    tx.vout = [CTxOut(COIN, b"\x00" * 25) for n in range(2)]
+    txdata = tx.serialize()
+    head = block.serialize_header()
+    coinbase = block.vtx[0].serialize()
+    ntx = max(0, (size - len(head) - 9 - len(coinbase)) // len(txdata))
+    # Only the first prevout hash (after nVersion and the vin count) differs
+    txs = [txdata[:5] + struct.pack("<Q", i + 1) + txdata[13:] for i in range(ntx)]
+    return head + ser_compact_size(ntx + 1) + coinbase + b"".join(txs)
+
 # From BIP141
 WITNESS_COMMITMENT_HEADER = b"\xaa\x21\xa9\xed"
 
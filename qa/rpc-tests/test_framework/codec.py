@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Navcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+#
+# codec.py - serialization primitives shared by the mininode objects
+#
+# ser_*: return the serialization of a value as bytes.  Vectors are built
+#        as a list of chunks and joined once, so their cost is linear in
+#        the number of entries.
+# deser_*(f): read a value from a file-like object (e.g. BytesIO).
+# deser_*_from(buf, offset): read a value from a buffer (bytes, memoryview)
+#        at offset and return (value, new_offset), without an intermediate
+#        bytes object per field.
+#
+# Every vector is prefixed with its length as a CompactSize, handled only by
+# ser_compact_size/deser_compact_size(_from).
+
+import struct
+
+UINT256_MASK = (1 << 256) - 1
+
+
+def ser_compact_size(l):
+    if l < 253:
+        return struct.pack("B", l)
+    elif l < 0x10000:
+        return struct.pack("<BH", 253, l)
+    elif l < 0x100000000:
+        return struct.pack("<BI", 254, l)
+    return struct.pack("<BQ", 255, l)
+
+
+def deser_compact_size(f):
+    nit = struct.unpack("<B", f.read(1))[0]
+    if nit == 253:
+        nit = struct.unpack("<H", f.read(2))[0]
+    elif nit == 254:
+        nit = struct.unpack("<I", f.read(4))[0]
+    elif nit == 255:
+        nit = struct.unpack("<Q", f.read(8))[0]
+    return nit
+
+
+def deser_compact_size_from(buf, offset):
+    nit = buf[offset]
+    offset += 1
+    if nit < 253:
+        return nit, offset
+    elif nit == 253:
+        nit = struct.unpack_from("<H", buf, offset)[0]
+        offset += 2
+    elif nit == 254:
+        nit = struct.unpack_from("<I", buf, offset)[0]
+        offset += 4
+    elif nit == 255:
+        nit = struct.unpack_from("<Q", buf, offset)[0]
+        offset += 8
+    return nit, offset
+
+
+def ser_string(s):
+    return ser_compact_size(len(s)) + s
+
+
+def deser_string(f):
+    nit = deser_compact_size(f)
+    return f.read(nit)
+
+
+def deser_string_from(buf, offset):
+    nit, offset = deser_compact_size_from(buf, offset)
+    return bytes(buf[offset:offset+nit]), offset + nit
+
+
+def ser_uint256(u):
+    return (u & UINT256_MASK).to_bytes(32, 'little')
+
+
+def deser_uint256(f):
+    return int.from_bytes(f.read(32), 'little')
+
+
+def deser_uint256_from(buf, offset):
+    return int.from_bytes(buf[offset:offset+32], 'little'), offset + 32
+
+
+def uint256_from_str(s):
+    return int.from_bytes(s[:32], 'little')
+
+
+def uint256_from_compact(c):
+    nbytes = (c >> 24) & 0xFF
+    v = (c & 0xFFFFFF) << (8 * (nbytes - 3))
+    return v
+
+
+# ser_function_name: Allow for an alternate serialization function on the
+# entries in the vector (we use this for serializing the vector of transactions
+# for a witness block).
+def ser_vector(l, ser_function_name=None):
+    r = [ser_compact_size(len(l))]
+    if ser_function_name:
+        r.extend(getattr(i, ser_function_name)() for i in l)
+    else:
+        r.extend(i.serialize() for i in l)
+    return b"".join(r)
+
+
+def deser_vector(f, c):
+    nit = deser_compact_size(f)
+    r = []
+    for i in range(nit):
+        t = c()
+        t.deserialize(f)
+        r.append(t)
+    return r
+
+
+def deser_vector_from(buf, offset, c):
+    nit, offset = deser_compact_size_from(buf, offset)
+    r = []
+    for i in range(nit):
+        t = c()
+        offset = t.deserialize_from(buf, offset)
+        r.append(t)
+    return r, offset
+
+
+def ser_uint256_vector(l):
+    r = [ser_compact_size(len(l))]
+    r.extend((u & UINT256_MASK).to_bytes(32, 'little') for u in l)
+    return b"".join(r)
+
+
+def deser_uint256_vector(f):
+    nit = deser_compact_size(f)
+    data = f.read(32 * nit)
+    return [int.from_bytes(data[i:i+32], 'little')
+            for i in range(0, len(data), 32)]
+
+
+def ser_string_vector(l):
+    r = [ser_compact_size(len(l))]
+    for sv in l:
+        r.append(ser_compact_size(len(sv)))
+        r.append(sv)
+    return b"".join(r)
+
+
+def deser_string_vector(f):
+    nit = deser_compact_size(f)
+    return [deser_string(f) for i in range(nit)]
+
+
+def deser_string_vector_from(buf, offset):
+    nit, offset = deser_compact_size_from(buf, offset)
+    r = []
+    for i in range(nit):
+        t, offset = deser_string_from(buf, offset)
+        r.append(t)
+    return r, offset
+
+
+def ser_int_vector(l):
+    return ser_compact_size(len(l)) + struct.pack("<%di" % len(l), *l)
+
+
+def deser_int_vector(f):
+    nit = deser_compact_size(f)
+    return list(struct.unpack("<%di" % nit, f.read(4 * nit)))
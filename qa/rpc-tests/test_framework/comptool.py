@@ -5,6 +5,7 @@
 
 from .mininode import *
 from .blockstore import BlockStore, TxStore
+from contextlib import contextmanager, ExitStack
 from .util import p2p_port
 
 '''
@@ -42,8 +43,8 @@ class RejectResult(object):
 
 class TestNode(NodeConnCB):
 
-    def __init__(self, block_store, tx_store):
-        NodeConnCB.__init__(self)
+    def __init__(self, block_store, tx_store, own_lock=False):
+        NodeConnCB.__init__(self, own_lock)
         self.conn = None
         self.bestblockhash = None
         self.block_store = block_store
@@ -170,8 +171,10 @@ class TestManager(object):
 
     def add_all_connections(self, nodes):
         for i in range(len(nodes)):
-            # Create a p2p connection to each node
-            test_node = TestNode(self.block_store, self.tx_store)
+            # Create a p2p connection to each node.  Each TestNode gets its
+            # own lock, so the nodes are served independently of each other
+            # (see mininode_lock).
+            test_node = TestNode(self.block_store, self.tx_store, own_lock=True)
             self.test_nodes.append(test_node)
             self.connections.append(NodeConn('127.0.0.1', p2p_port(i), nodes[i], test_node))
             # Make sure the TestNode (callback class) has a reference to its
@@ -182,33 +185,36 @@ class TestManager(object):
         self.connections    = []
         self.test_nodes     = []
 
+    # Wait until predicate(node) is true for every test node, waiting on
+    # each node's own condition in turn (the predicates used here stay true
+    # once they are).  attempts and timeout bound the total wait, as in
+    # wait_until.
+    def wait_for_all(self, predicate, attempts=float('inf'), timeout=float('inf')):
+        deadline = time.time() + min(timeout, attempts * 0.05)
+        for node in self.test_nodes:
+            if not wait_until(lambda: predicate(node), timeout=deadline - time.time(),
+                              cond=node.cond):
+                return False
+        return True
+
     def wait_for_disconnections(self):
-        def disconnected():
-            return all(node.closed for node in self.test_nodes)
-        return wait_until(disconnected, timeout=10)
+        return self.wait_for_all(lambda node: node.closed, timeout=10)
 
     def wait_for_verack(self):
-        def veracked():
-            return all(node.verack_received for node in self.test_nodes)
-        return wait_until(veracked, timeout=10)
+        return self.wait_for_all(lambda node: node.verack_received, timeout=10)
 
     def wait_for_pings(self, counter):
-        def received_pongs():
-            return all(node.received_ping_response(counter) for node in self.test_nodes)
-        return wait_until(received_pongs)
+        return self.wait_for_all(lambda node: node.received_ping_response(counter))
 
     # sync_blocks: Wait for all connections to request the blockhash given
     # then send get_headers to find out the tip of each node, and synchronize
     # the response by using a ping (and waiting for pong with same nonce).
     def sync_blocks(self, blockhash, num_blocks):
-        def blocks_requested():
-            return all(
-                blockhash in node.block_request_map and node.block_request_map[blockhash]
-                for node in self.test_nodes
-            )
+        def block_requested(node):
+            return blockhash in node.block_request_map and node.block_request_map[blockhash]
 
         # --> error if not requested
-        if not wait_until(blocks_requested, attempts=20*num_blocks):
+        if not self.wait_for_all(block_requested, attempts=20*num_blocks):
             # print [ c.cb.block_request_map for c in self.connections ]
             raise AssertionError("Not all nodes requested block")
 
@@ -223,14 +229,11 @@ class TestManager(object):
     # Analogous to sync_block (see above)
     def sync_transaction(self, txhash, num_events):
         # Wait for nodes to request transaction (50ms sleep * 20 tries * num_events)
-        def transaction_requested():
-            return all(
-                txhash in node.tx_request_map and node.tx_request_map[txhash]
-                for node in self.test_nodes
-            )
+        def transaction_requested(node):
+            return txhash in node.tx_request_map and node.tx_request_map[txhash]
 
         # --> error if not requested
-        if not wait_until(transaction_requested, attempts=20*num_events):
+        if not self.wait_for_all(transaction_requested, attempts=20*num_events):
             # print [ c.cb.tx_request_map for c in self.connections ]
             raise AssertionError("Not all nodes requested transaction")
 
@@ -243,13 +246,23 @@ class TestManager(object):
         self.ping_counter += 1
 
         # Sort inv responses from each node
-        with mininode_lock:
-            [ c.cb.lastInv.sort() for c in self.connections ]
+        for c in self.connections:
+            with c.cb.lock:
+                c.cb.lastInv.sort()
+
+    # Hold every test node's lock, e.g. to compare their state or update the
+    # block/tx stores they serve from.
+    @contextmanager
+    def all_nodes_locked(self):
+        with ExitStack() as stack:
+            for node in self.test_nodes:
+                stack.enter_context(node.lock)
+            yield
 
     # Verify that the tip of each connection all agree with each other, and
     # with the expected outcome (if given)
     def check_results(self, blockhash, outcome):
-        with mininode_lock:
+        with self.all_nodes_locked():
             for c in self.connections:
                 if outcome is None:
                     if c.cb.bestblockhash != self.connections[0].cb.bestblockhash:
@@ -275,7 +288,7 @@ class TestManager(object):
     # perhaps it would be useful to add the ability to check explicitly that
     # a particular tx's existence in the mempool is the same across all nodes.
     def check_mempool(self, txhash, outcome):
-        with mininode_lock:
+        with self.all_nodes_locked():
             for c in self.connections:
                 if outcome is None:
                     # Make sure the mempools agree with each other
@@ -332,7 +345,7 @@ class TestManager(object):
                     first_block_with_hash = True
                     if self.block_store.get(block.sha256) is not None:
                         first_block_with_hash = False
-                    with mininode_lock:
+                    with self.all_nodes_locked():
                         self.block_store.add_block(block)
                         for c in self.connections:
                             if first_block_with_hash and block.sha256 in c.cb.block_request_map and c.cb.block_request_map[block.sha256] == True:
@@ -359,7 +372,7 @@ class TestManager(object):
                     tx = b_or_t
                     tx_outcome = outcome
                     # Add to shared tx store and clear map entry
-                    with mininode_lock:
+                    with self.all_nodes_locked():
                         self.tx_store.add_transaction(tx)
                         for c in self.connections:
                             c.cb.tx_request_map[tx.sha256] = False
@@ -12,10 +12,14 @@ testing.
 
 """
 import os
+from collections import Counter
 
 
 REFERENCE_FILENAME = 'rpc_interface.txt'
 
+# RPC calls made through AuthServiceProxyWrapper so far, by method
+rpc_call_counts = Counter()
+
 
 class AuthServiceProxyWrapper(object):
     """
@@ -46,8 +50,27 @@ class AuthServiceProxyWrapper(object):
         called to a file.
 
         """
+        rpc_method = self.auth_service_proxy_instance._service_name
+        # Count calls that fail too
+        rpc_call_counts[rpc_method] += 1
         return_val = self.auth_service_proxy_instance.__call__(*args, **kwargs)
+
+        if self.coverage_logfile:
+            with open(self.coverage_logfile, 'a+') as f:
+                f.write("%s\n" % rpc_method)
+
+        return return_val
+
+    def stream(self, *args):
+        """
+        Delegates to AuthServiceProxy.stream(), then writes the particular
+        RPC method called to a file.
+
+        """
         rpc_method = self.auth_service_proxy_instance._service_name
+        # Count calls that fail too
+        rpc_call_counts[rpc_method] += 1
+        return_val = self.auth_service_proxy_instance.stream(*args)
 
         if self.coverage_logfile:
             with open(self.coverage_logfile, 'a+') as f:
@@ -55,6 +78,23 @@ class AuthServiceProxyWrapper(object):
 
         return return_val
 
+    def batch(self, *args, **kwargs):
+        """
+        Delegates to AuthServiceProxy.batch(), writing the RPC methods of
+        each batch request sent to the file.
+
+        """
+        batch = self.auth_service_proxy_instance.batch(*args, **kwargs)
+
+        def log_methods(methods):
+            rpc_call_counts.update(methods)
+            if self.coverage_logfile:
+                with open(self.coverage_logfile, 'a+') as f:
+                    f.writelines("%s\n" % rpc_method for rpc_method in methods)
+        batch.on_execute = log_methods
+
+        return batch
+
     @property
     def url(self):
         return self.auth_service_proxy_instance.url
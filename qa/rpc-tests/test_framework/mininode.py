@@ -20,22 +20,29 @@
 # msg_block, msg_tx, msg_headers, etc.:
 #     data structures that represent network messages
 # ser_*, deser_*: functions that handle serialization/deserialization
+#                 (see codec.py)
+#
+# Requires Python 3.7 or newer: NodeConn is an asyncio.BufferedProtocol.
 
 
 import struct
 import socket
-import asyncore
+import asyncio
 import time
 import sys
 import random
 from .util import hex_str_to_bytes, bytes_to_hex_str
+from .codec import *
 from io import BytesIO
 from codecs import encode
 import hashlib
+import multiprocessing
+from threading import Condition
 from threading import RLock
 from threading import Thread
 import logging
 import copy
+from collections import deque
 
 BIP0031_VERSION = 60000
 MY_VERSION = 60001  # past bip-31 for ping/pong
@@ -51,204 +58,92 @@ NODE_GETUTXO = (1 << 1)
 NODE_BLOOM = (1 << 2)
 NODE_WITNESS = (1 << 3)
 
-# Keep our own socket map for asyncore, so that we can track disconnects
-# ourselves (to workaround an issue with closing an asyncore socket when 
-# using select)
+# The connections driven by the network thread, keyed by id().  A NodeConn
+# registers itself here when created (the actual connect is deferred until the
+# NetworkThread's event loop runs) and removes itself once its socket is
+# closed; NetworkThread.run() returns once the map is empty.
 mininode_socket_map = dict()
 
-# One lock for synchronizing all data access between the networking thread (see
-# NetworkThread below) and the thread running the test logic.  For simplicity,
-# NodeConn acquires this lock whenever delivering a message to to a NodeConnCB,
-# and whenever adding anything to the send buffer (in send_message()).  This
-# lock should be acquired in the thread running the test logic to synchronize
-# access to any data shared with the NodeConnCB or NodeConn.
+# The asyncio event loop of the running NetworkThread, or None.  Guarded by
+# mininode_lock.
+mininode_loop = None
+
+# Bytes sent and received over all connections so far, for the test's
+# resource report.  Only updated by the network thread.
+mininode_bytes_sent = 0
+mininode_bytes_recv = 0
+
+# Handoff between the networking thread (see NetworkThread below) and the
+# thread running the test logic:
+#
+# - Each NodeConnCB has a lock (NodeConnCB.lock) that is held while a message
+#   is delivered to it.  The test logic should hold the same lock to access
+#   any data shared with that callback.  Received messages are queued per
+#   connection (NodeConn.recv_queue); if the test logic holds the callback's
+#   lock, the connection's messages wait in the queue while the network thread
+#   keeps serving the other connections.
+# - send_message() only appends to the connection's send_queue, which the
+#   network thread drains; it takes no lock and can be called from any thread.
+# - Each NodeConnCB has a condition (NodeConnCB.cond) on its lock, notified
+#   after every delivery and when its connection opens or closes; wait_until()
+#   blocks on it.
+#
+# A callback created with own_lock=True gets a lock of its own (an RLock, as
+# on_* handlers may take it again).  For compatibility, callbacks that don't
+# ask for a lock of their own all share mininode_lock (and mininode_cond), so
+# existing tests can keep acquiring mininode_lock around any data shared with
+# the network thread.
+# mininode_lock also guards mininode_socket_map and mininode_loop.
 mininode_lock = RLock()
+mininode_cond = Condition(mininode_lock)
+
+# Waiters still re-check their predicate this often, for state that changes
+# without a notification (e.g. set directly by the test logic).
+WAIT_RECHECK_INTERVAL = 0.5
 
 # Serialization/deserialization tools
 def sha256(s):
-    return hashlib.new('sha256', s).digest()
+    return hashlib.sha256(s).digest()
 
 def ripemd160(s):
     return hashlib.new('ripemd160', s).digest()
 
 def hash256(s):
-    return sha256(sha256(s))
-
-
-def deser_string(f):
-    nit = struct.unpack("<B", f.read(1))[0]
-    if nit == 253:
-        nit = struct.unpack("<H", f.read(2))[0]
-    elif nit == 254:
-        nit = struct.unpack("<I", f.read(4))[0]
-    elif nit == 255:
-        nit = struct.unpack("<Q", f.read(8))[0]
-    return f.read(nit)
-
-def ser_string(s):
-    if len(s) < 253:
-        return struct.pack("B", len(s)) + s
-    elif len(s) < 0x10000:
-        return struct.pack("<BH", 253, len(s)) + s
-    elif len(s) < 0x100000000:
-        return struct.pack("<BI", 254, len(s)) + s
-    return struct.pack("<BQ", 255, len(s)) + s
-
-def deser_uint256(f):
-    r = 0
-    for i in range(8):
-        t = struct.unpack("<I", f.read(4))[0]
-        r += t << (i * 32)
-    return r
-
-
-def ser_uint256(u):
-    rs = b""
-    for i in range(8):
-        rs += struct.pack("<I", u & 0xFFFFFFFF)
-        u >>= 32
-    return rs
-
-
-def uint256_from_str(s):
-    r = 0
-    t = struct.unpack("<IIIIIIII", s[:32])
-    for i in range(8):
-        r += t[i] << (i * 32)
-    return r
-
-
-def uint256_from_compact(c):
-    nbytes = (c >> 24) & 0xFF
-    v = (c & 0xFFFFFF) << (8 * (nbytes - 3))
-    return v
-
-
-def deser_vector(f, c):
-    nit = struct.unpack("<B", f.read(1))[0]
-    if nit == 253:
-        nit = struct.unpack("<H", f.read(2))[0]
-    elif nit == 254:
-        nit = struct.unpack("<I", f.read(4))[0]
-    elif nit == 255:
-        nit = struct.unpack("<Q", f.read(8))[0]
-    r = []
-    for i in range(nit):
-        t = c()
-        t.deserialize(f)
-        r.append(t)
-    return r
-
-
-# ser_function_name: Allow for an alternate serialization function on the
-# entries in the vector (we use this for serializing the vector of transactions
-# for a witness block).
-def ser_vector(l, ser_function_name=None):
-    r = b""
-    if len(l) < 253:
-        r = struct.pack("B", len(l))
-    elif len(l) < 0x10000:
-        r = struct.pack("<BH", 253, len(l))
-    elif len(l) < 0x100000000:
-        r = struct.pack("<BI", 254, len(l))
-    else:
-        r = struct.pack("<BQ", 255, len(l))
-    for i in l:
-        if ser_function_name:
-            r += getattr(i, ser_function_name)()
-        else:
-            r += i.serialize()
-    return r
-
-
-def deser_uint256_vector(f):
-    nit = struct.unpack("<B", f.read(1))[0]
-    if nit == 253:
-        nit = struct.unpack("<H", f.read(2))[0]
-    elif nit == 254:
-        nit = struct.unpack("<I", f.read(4))[0]
-    elif nit == 255:
-        nit = struct.unpack("<Q", f.read(8))[0]
-    r = []
-    for i in range(nit):
-        t = deser_uint256(f)
-        r.append(t)
-    return r
-
-
-def ser_uint256_vector(l):
-    r = b""
-    if len(l) < 253:
-        r = struct.pack("B", len(l))
-    elif len(l) < 0x10000:
-        r = struct.pack("<BH", 253, len(l))
-    elif len(l) < 0x100000000:
-        r = struct.pack("<BI", 254, len(l))
-    else:
-        r = struct.pack("<BQ", 255, len(l))
-    for i in l:
-        r += ser_uint256(i)
-    return r
-
-
-def deser_string_vector(f):
-    nit = struct.unpack("<B", f.read(1))[0]
-    if nit == 253:
-        nit = struct.unpack("<H", f.read(2))[0]
-    elif nit == 254:
-        nit = struct.unpack("<I", f.read(4))[0]
-    elif nit == 255:
-        nit = struct.unpack("<Q", f.read(8))[0]
-    r = []
-    for i in range(nit):
-        t = deser_string(f)
-        r.append(t)
-    return r
-
-
-def ser_string_vector(l):
-    r = b""
-    if len(l) < 253:
-        r = struct.pack("B", len(l))
-    elif len(l) < 0x10000:
-        r = struct.pack("<BH", 253, len(l))
-    elif len(l) < 0x100000000:
-        r = struct.pack("<BI", 254, len(l))
-    else:
-        r = struct.pack("<BQ", 255, len(l))
-    for sv in l:
-        r += ser_string(sv)
-    return r
-
-
-def deser_int_vector(f):
-    nit = struct.unpack("<B", f.read(1))[0]
-    if nit == 253:
-        nit = struct.unpack("<H", f.read(2))[0]
-    elif nit == 254:
-        nit = struct.unpack("<I", f.read(4))[0]
-    elif nit == 255:
-        nit = struct.unpack("<Q", f.read(8))[0]
-    r = []
-    for i in range(nit):
-        t = struct.unpack("<i", f.read(4))[0]
-        r.append(t)
-    return r
-
-
-def ser_int_vector(l):
-    r = b""
-    if len(l) < 253:
-        r = struct.pack("B", len(l))
-    elif len(l) < 0x10000:
-        r = struct.pack("<BH", 253, len(l))
-    elif len(l) < 0x100000000:
-        r = struct.pack("<BI", 254, len(l))
-    else:
-        r = struct.pack("<BQ", 255, len(l))
-    for i in l:
-        r += struct.pack("<i", i)
-    return r
+    return hashlib.sha256(hashlib.sha256(s).digest()).digest()
+
+# Find the first nonce in [start, end) for which the 80-byte block header
+# hashes to at most target, or None.  The SHA-256 state after the first 64
+# header bytes (the midstate) doesn't depend on the nonce, so it is computed
+# once and copied for each nonce, leaving only the last 16 bytes to hash.
+def solve_header_nonce(header, target, start=0, end=1 << 32):
+    midstate = hashlib.sha256(header[:64])
+    tail = header[64:76]
+    pack_nonce = struct.Struct("<I").pack
+    sha256_ = hashlib.sha256
+    from_bytes = int.from_bytes
+    for nonce in range(start, end):
+        h = midstate.copy()
+        h.update(tail + pack_nonce(nonce))
+        if from_bytes(sha256_(h.digest()).digest(), 'little') <= target:
+            return nonce
+    return None
+
+def _solve_header_nonce_range(args):
+    return solve_header_nonce(*args)
+
+# As solve_header_nonce, but split the nonce space into chunks searched by a
+# pool of processes (one per core if processes is None).  Chunks are
+# consumed in order, so the result is the same as solve_header_nonce's.
+def solve_header_nonce_parallel(header, target, start=0, end=1 << 32,
+                                processes=None, chunk_size=1 << 16):
+    chunks = ((header, target, i, min(i + chunk_size, end))
+              for i in range(start, end, chunk_size))
+    with multiprocessing.Pool(processes) as pool:
+        for nonce in pool.imap(_solve_header_nonce_range, chunks):
+            if nonce is not None:
+                return nonce
+    return None
+
 
 # Deserialize from a hex string representation (eg from RPC)
 def FromHex(obj, hex_string):
@@ -261,7 +156,77 @@ def ToHex(obj):
 
 # Objects that map to navcoind objects, which can be serialized/deserialized
 
+# Base for objects that can also be parsed straight out of a buffer with
+# deserialize_from(buf, offset), which must return the offset just past the
+# object.
+class BufferDeserializable(object):
+    __slots__ = ()
+
+    @classmethod
+    def from_buffer(cls, buf, offset=0):
+        obj = cls()
+        offset = obj.deserialize_from(memoryview(buf), offset)
+        return obj, offset
+
+# Objects that keep their last serialization (and its double-SHA256) around,
+# so re-serializing or re-hashing an unchanged object is cheap.  The cache is
+# stored together with a key of the field values it was built from (for
+# containers: their children's serializations), and is only reused while the
+# current key compares equal, so fields can be mutated freely.  Field values
+# are expected to be immutable (ints, bytes, CScript); in-place changes to a
+# bytearray field can't be detected, so such objects are never cached.
+class CachedSerializable(BufferDeserializable):
+    __slots__ = ('_ser_cache', '_hash_cache')
+
+    def __new__(cls, *args, **kwargs):
+        obj = super(CachedSerializable, cls).__new__(cls)
+        obj._ser_cache = None # (key, serialization)
+        obj._hash_cache = None # (serialization, hash256)
+        return obj
+
+    def _get_cached(self, key):
+        c = self._ser_cache
+        if c is not None and c[0] == key:
+            return c[1]
+        return None
+
+    # Double-SHA256 of data, reused while data is the same (cached) object
+    def _get_hash256(self, data):
+        c = self._hash_cache
+        if c is None or c[0] is not data:
+            c = (data, hash256(data))
+            self._hash_cache = c
+        return c[1]
+
+
+# A uint256 attribute kept in the given slot either as an int or, straight
+# after deserialization, as its 32-byte serialization; it is only converted
+# to an int when read.
+class Uint256Field(object):
+    def __init__(self, slot):
+        self.slot = slot
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        v = getattr(obj, self.slot)
+        if isinstance(v, bytes):
+            v = int.from_bytes(v, 'little')
+            setattr(obj, self.slot, v)
+        return v
+
+    def __set__(self, obj, value):
+        setattr(obj, self.slot, value)
+
+# Serialization of a Uint256Field slot value
+def ser_uint256_field(v):
+    if isinstance(v, bytes):
+        return v
+    return ser_uint256(v)
+
 class CAddress(object):
+    __slots__ = ('nServices', 'pchReserved', 'ip', 'port')
+
     def __init__(self):
         self.nServices = 1
         self.pchReserved = b"\x00" * 10 + b"\xff" * 2
@@ -289,6 +254,8 @@ class CAddress(object):
 MSG_WITNESS_FLAG = 1<<30
 
 class CInv(object):
+    __slots__ = ('type', '_hash')
+    hash = Uint256Field('_hash')
     typemap = {
         0: "Error",
         1: "TX",
@@ -303,12 +270,12 @@ class CInv(object):
 
     def deserialize(self, f):
         self.type = struct.unpack("<i", f.read(4))[0]
-        self.hash = deser_uint256(f)
+        self._hash = f.read(32)
 
     def serialize(self):
         r = b""
         r += struct.pack("<i", self.type)
-        r += ser_uint256(self.hash)
+        r += ser_uint256_field(self._hash)
         return r
 
     def __repr__(self):
@@ -336,26 +303,38 @@ class CBlockLocator(object):
             % (self.nVersion, repr(self.vHave))
 
 
-class COutPoint(object):
+class COutPoint(CachedSerializable):
+    __slots__ = ('_hash', 'n')
+    hash = Uint256Field('_hash')
+
     def __init__(self, hash=0, n=0):
-        self.hash = hash
+        self._hash = hash
         self.n = n
 
     def deserialize(self, f):
-        self.hash = deser_uint256(f)
+        self._hash = f.read(32)
         self.n = struct.unpack("<I", f.read(4))[0]
 
+    def deserialize_from(self, buf, offset):
+        self._hash = bytes(buf[offset:offset+32])
+        self.n = struct.unpack_from("<I", buf, offset + 32)[0]
+        return offset + 36
+
     def serialize(self):
-        r = b""
-        r += ser_uint256(self.hash)
-        r += struct.pack("<I", self.n)
+        key = (self._hash, self.n)
+        r = self._get_cached(key)
+        if r is None:
+            r = ser_uint256_field(self._hash) + struct.pack("<I", self.n)
+            self._ser_cache = (key, r)
         return r
 
     def __repr__(self):
         return "COutPoint(hash=%064x n=%i)" % (self.hash, self.n)
 
 
-class CTxIn(object):
+class CTxIn(CachedSerializable):
+    __slots__ = ('prevout', 'scriptSig', 'nSequence')
+
     def __init__(self, outpoint=None, scriptSig=b"", nSequence=0):
         if outpoint is None:
             self.prevout = COutPoint()
@@ -370,11 +349,20 @@ class CTxIn(object):
         self.scriptSig = deser_string(f)
         self.nSequence = struct.unpack("<I", f.read(4))[0]
 
+    def deserialize_from(self, buf, offset):
+        self.prevout = COutPoint()
+        offset = self.prevout.deserialize_from(buf, offset)
+        self.scriptSig, offset = deser_string_from(buf, offset)
+        self.nSequence = struct.unpack_from("<I", buf, offset)[0]
+        return offset + 4
+
     def serialize(self):
-        r = b""
-        r += self.prevout.serialize()
-        r += ser_string(self.scriptSig)
-        r += struct.pack("<I", self.nSequence)
+        key = (self.prevout.serialize(), self.scriptSig, self.nSequence)
+        r = self._get_cached(key)
+        if r is None:
+            r = key[0] + ser_string(self.scriptSig) + struct.pack("<I", self.nSequence)
+            if isinstance(self.scriptSig, bytes):
+                self._ser_cache = (key, r)
         return r
 
     def __repr__(self):
@@ -383,7 +371,9 @@ class CTxIn(object):
                self.nSequence)
 
 
-class CTxOut(object):
+class CTxOut(CachedSerializable):
+    __slots__ = ('nValue', 'scriptPubKey')
+
     def __init__(self, nValue=0, scriptPubKey=b""):
         self.nValue = nValue
         self.scriptPubKey = scriptPubKey
@@ -392,10 +382,18 @@ class CTxOut(object):
         self.nValue = struct.unpack("<q", f.read(8))[0]
         self.scriptPubKey = deser_string(f)
 
+    def deserialize_from(self, buf, offset):
+        self.nValue = struct.unpack_from("<q", buf, offset)[0]
+        self.scriptPubKey, offset = deser_string_from(buf, offset + 8)
+        return offset
+
     def serialize(self):
-        r = b""
-        r += struct.pack("<q", self.nValue)
-        r += ser_string(self.scriptPubKey)
+        key = (self.nValue, self.scriptPubKey)
+        r = self._get_cached(key)
+        if r is None:
+            r = struct.pack("<q", self.nValue) + ser_string(self.scriptPubKey)
+            if isinstance(self.scriptPubKey, bytes):
+                self._ser_cache = (key, r)
         return r
 
     def __repr__(self):
@@ -405,6 +403,8 @@ class CTxOut(object):
 
 
 class CScriptWitness(object):
+    __slots__ = ('stack',)
+
     def __init__(self):
         # stack is a vector of strings
         self.stack = []
@@ -420,12 +420,18 @@ class CScriptWitness(object):
 
 
 class CTxInWitness(object):
+    __slots__ = ('scriptWitness',)
+
     def __init__(self):
         self.scriptWitness = CScriptWitness()
 
     def deserialize(self, f):
         self.scriptWitness.stack = deser_string_vector(f)
 
+    def deserialize_from(self, buf, offset):
+        self.scriptWitness.stack, offset = deser_string_vector_from(buf, offset)
+        return offset
+
     def serialize(self):
         return ser_string_vector(self.scriptWitness.stack)
 
@@ -437,6 +443,8 @@ class CTxInWitness(object):
 
 
 class CTxWitness(object):
+    __slots__ = ('vtxinwit',)
+
     def __init__(self):
         self.vtxinwit = []
 
@@ -444,6 +452,11 @@ class CTxWitness(object):
         for i in range(len(self.vtxinwit)):
             self.vtxinwit[i].deserialize(f)
 
+    def deserialize_from(self, buf, offset):
+        for i in range(len(self.vtxinwit)):
+            offset = self.vtxinwit[i].deserialize_from(buf, offset)
+        return offset
+
     def serialize(self):
         r = b""
         # This is different than the usual vector serialization --
@@ -464,7 +477,9 @@ class CTxWitness(object):
         return True
 
 
-class CTransaction(object):
+class CTransaction(CachedSerializable):
+    __slots__ = ('nVersion', 'vin', 'vout', 'wit', 'nLockTime', 'sha256', 'hash')
+
     def __init__(self, tx=None):
         if tx is None:
             self.nVersion = 1
@@ -497,18 +512,45 @@ class CTransaction(object):
         else:
             self.vout = deser_vector(f, CTxOut)
         if flags != 0:
-            self.wit.vtxinwit = [CTxInWitness()]*len(self.vin)
+            self.wit.vtxinwit = [CTxInWitness() for i in range(len(self.vin))]
             self.wit.deserialize(f)
         self.nLockTime = struct.unpack("<I", f.read(4))[0]
         self.sha256 = None
         self.hash = None
 
+    def deserialize_from(self, buf, offset):
+        self.nVersion = struct.unpack_from("<i", buf, offset)[0]
+        self.vin, offset = deser_vector_from(buf, offset + 4, CTxIn)
+        flags = 0
+        if len(self.vin) == 0:
+            flags = buf[offset]
+            offset += 1
+            if (flags != 0):
+                self.vin, offset = deser_vector_from(buf, offset, CTxIn)
+                self.vout, offset = deser_vector_from(buf, offset, CTxOut)
+        else:
+            self.vout, offset = deser_vector_from(buf, offset, CTxOut)
+        if flags != 0:
+            self.wit.vtxinwit = [CTxInWitness() for i in range(len(self.vin))]
+            offset = self.wit.deserialize_from(buf, offset)
+        self.nLockTime = struct.unpack_from("<I", buf, offset)[0]
+        self.sha256 = None
+        self.hash = None
+        return offset + 4
+
     def serialize_without_witness(self):
-        r = b""
-        r += struct.pack("<i", self.nVersion)
-        r += ser_vector(self.vin)
-        r += ser_vector(self.vout)
-        r += struct.pack("<I", self.nLockTime)
+        # vin/vout may be mutated in place, so the key holds the children's
+        # (cached) serializations.
+        vin = [x.serialize() for x in self.vin]
+        vout = [x.serialize() for x in self.vout]
+        key = (self.nVersion, self.nLockTime, vin, vout)
+        r = self._get_cached(key)
+        if r is None:
+            r = b"".join([struct.pack("<i", self.nVersion),
+                          ser_compact_size(len(vin))] + vin +
+                         [ser_compact_size(len(vout))] + vout +
+                         [struct.pack("<I", self.nLockTime)])
+            self._ser_cache = (key, r)
         return r
 
     # Only serialize with witness when explicitly called for
@@ -551,9 +593,10 @@ class CTransaction(object):
             # Don't cache the result, just return it
             return uint256_from_str(hash256(self.serialize_with_witness()))
 
+        txid = self._get_hash256(self.serialize_without_witness())
         if self.sha256 is None:
-            self.sha256 = uint256_from_str(hash256(self.serialize_without_witness()))
-        self.hash = encode(hash256(self.serialize())[::-1], 'hex_codec').decode('ascii')
+            self.sha256 = uint256_from_str(txid)
+        self.hash = txid[::-1].hex()
 
     def is_valid(self):
         self.calc_sha256()
@@ -567,14 +610,19 @@ class CTransaction(object):
             % (self.nVersion, repr(self.vin), repr(self.vout), self.nLockTime)
 
 
-class CBlockHeader(object):
+class CBlockHeader(CachedSerializable):
+    __slots__ = ('nVersion', '_hashPrevBlock', '_hashMerkleRoot', 'nTime',
+                 'nBits', 'nNonce', 'sha256', 'hash')
+    hashPrevBlock = Uint256Field('_hashPrevBlock')
+    hashMerkleRoot = Uint256Field('_hashMerkleRoot')
+
     def __init__(self, header=None):
         if header is None:
             self.set_null()
         else:
             self.nVersion = header.nVersion
-            self.hashPrevBlock = header.hashPrevBlock
-            self.hashMerkleRoot = header.hashMerkleRoot
+            self._hashPrevBlock = header._hashPrevBlock
+            self._hashMerkleRoot = header._hashMerkleRoot
             self.nTime = header.nTime
             self.nBits = header.nBits
             self.nNonce = header.nNonce
@@ -594,35 +642,47 @@ class CBlockHeader(object):
 
     def deserialize(self, f):
         self.nVersion = struct.unpack("<i", f.read(4))[0]
-        self.hashPrevBlock = deser_uint256(f)
-        self.hashMerkleRoot = deser_uint256(f)
+        self._hashPrevBlock = f.read(32)
+        self._hashMerkleRoot = f.read(32)
         self.nTime = struct.unpack("<I", f.read(4))[0]
         self.nBits = struct.unpack("<I", f.read(4))[0]
         self.nNonce = struct.unpack("<I", f.read(4))[0]
         self.sha256 = None
         self.hash = None
 
-    def serialize(self):
-        r = b""
-        r += struct.pack("<i", self.nVersion)
-        r += ser_uint256(self.hashPrevBlock)
-        r += ser_uint256(self.hashMerkleRoot)
-        r += struct.pack("<I", self.nTime)
-        r += struct.pack("<I", self.nBits)
-        r += struct.pack("<I", self.nNonce)
-        return r
+    def deserialize_from(self, buf, offset):
+        self.nVersion = struct.unpack_from("<i", buf, offset)[0]
+        self._hashPrevBlock = bytes(buf[offset+4:offset+36])
+        self._hashMerkleRoot = bytes(buf[offset+36:offset+68])
+        (self.nTime, self.nBits, self.nNonce) = struct.unpack_from("<III", buf, offset + 68)
+        self.sha256 = None
+        self.hash = None
+        return offset + 80
 
-    def calc_sha256(self):
-        if self.sha256 is None:
+    def serialize(self):
+        return self.serialize_header()
+
+    # The 80-byte header, also for CBlock (whose serialize() adds the vtx)
+    def serialize_header(self):
+        key = (self.nVersion, self._hashPrevBlock, self._hashMerkleRoot,
+               self.nTime, self.nBits, self.nNonce)
+        r = self._get_cached(key)
+        if r is None:
             r = b""
             r += struct.pack("<i", self.nVersion)
-            r += ser_uint256(self.hashPrevBlock)
-            r += ser_uint256(self.hashMerkleRoot)
+            r += ser_uint256_field(self._hashPrevBlock)
+            r += ser_uint256_field(self._hashMerkleRoot)
             r += struct.pack("<I", self.nTime)
             r += struct.pack("<I", self.nBits)
             r += struct.pack("<I", self.nNonce)
-            self.sha256 = uint256_from_str(hash256(r))
-            self.hash = encode(hash256(r)[::-1], 'hex_codec').decode('ascii')
+            self._ser_cache = (key, r)
+        return r
+
+    def calc_sha256(self):
+        if self.sha256 is None:
+            h = self._get_hash256(self.serialize_header())
+            self.sha256 = uint256_from_str(h)
+            self.hash = encode(h[::-1], 'hex_codec').decode('ascii')
 
     def rehash(self):
         self.sha256 = None
@@ -635,18 +695,148 @@ class CBlockHeader(object):
                time.ctime(self.nTime), self.nBits, self.nNonce)
 
 
+# A merkle tree over 32-byte leaf hashes that keeps every level, so changing,
+# appending or popping a leaf only rehashes the path(s) up to the root.  Odd
+# levels duplicate their last node, as in navcoind's ComputeMerkleRoot.
+class MerkleTree(object):
+    def __init__(self, leaves=None):
+        self.levels = [[]]
+        self.dirty = set() # changed leaf indices since the last recompute
+        self.synced_len = 0 # number of leaves at the last recompute
+        self.values = [] # leaves as uint256, when set by update_uint256
+        if leaves is not None:
+            self.update(leaves)
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    def append(self, leaf):
+        self.values = None
+        self.dirty.add(len(self.levels[0]))
+        self.levels[0].append(leaf)
+
+    def replace(self, index, leaf):
+        self.values = None
+        self.levels[0][index] = leaf
+        self.dirty.add(index)
+
+    def pop(self):
+        self.values = None
+        return self.levels[0].pop()
+
+    # Like update, with the leaves given as uint256 integers; only the
+    # values that differ from the previous call are serialized, and an
+    # unchanged list costs a single comparison
+    def update_uint256(self, values):
+        old = self.values
+        if old is None:
+            self.update([ser_uint256(v) for v in values])
+        elif values != old:
+            n = min(len(old), len(values))
+            if old[:n] != values[:n]:
+                for i in range(n):
+                    if old[i] != values[i]:
+                        self.replace(i, ser_uint256(values[i]))
+            del self.levels[0][len(values):]
+            for i in range(n, len(values)):
+                self.append(ser_uint256(values[i]))
+        self.values = values
+
+    # Make the leaves equal to the given list, only touching what differs
+    def update(self, leaves):
+        self.values = None
+        cur = self.levels[0]
+        n = min(len(cur), len(leaves))
+        for i in range(n):
+            if cur[i] != leaves[i]:
+                cur[i] = leaves[i]
+                self.dirty.add(i)
+        del cur[len(leaves):]
+        for i in range(n, len(leaves)):
+            self.append(leaves[i])
+
+    def recompute(self):
+        dirty = self.dirty
+        old_len = self.synced_len
+        level = 0
+        while True:
+            cur = self.levels[level]
+            # A length change re-pairs the last node (it may now be
+            # duplicated, or no longer be)
+            if len(cur) != old_len and cur:
+                dirty.add(len(cur) - 1)
+            if len(cur) <= 1:
+                break
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            parent = self.levels[level + 1]
+            old_len = len(parent)
+            n = (len(cur) + 1) // 2
+            del parent[n:]
+            parent.extend([None] * (n - len(parent)))
+            pdirty = set(i >> 1 for i in dirty if i < len(cur))
+            for j in pdirty:
+                left = cur[2*j]
+                right = cur[2*j + 1] if 2*j + 1 < len(cur) else left
+                parent[j] = hash256(left + right)
+            dirty = pdirty
+            level += 1
+        del self.levels[level + 1:]
+        self.dirty = set()
+        self.synced_len = len(self.levels[0])
+
+    def root(self):
+        if self.dirty or len(self.levels[0]) != self.synced_len:
+            self.recompute()
+        if not self.levels[-1]:
+            return ser_uint256(0)
+        return self.levels[-1][0]
+
+    # Sibling hashes from the leaf at index up to (excluding) the root
+    def branch(self, index):
+        self.root()
+        r = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling >= len(level):
+                sibling = index
+            r.append(level[sibling])
+            index >>= 1
+        return r
+
+    # Compute the root implied by a leaf and its merkle branch
+    @staticmethod
+    def root_from_branch(leaf, branch, index):
+        h = leaf
+        for sibling in branch:
+            if index & 1:
+                h = hash256(sibling + h)
+            else:
+                h = hash256(h + sibling)
+            index >>= 1
+        return h
+
+
 class CBlock(CBlockHeader):
     def __init__(self, header=None):
         super(CBlock, self).__init__(header)
         self.vtx = []
+        # Kept in step with vtx by calc_(witness_)merkle_root()
+        self.merkle_tree = MerkleTree()
+        self.witness_merkle_tree = MerkleTree()
 
     def deserialize(self, f):
         super(CBlock, self).deserialize(f)
         self.vtx = deser_vector(f, CTransaction)
 
+    def deserialize_from(self, buf, offset):
+        offset = super(CBlock, self).deserialize_from(buf, offset)
+        self.vtx, offset = deser_vector_from(buf, offset, CTransaction)
+        return offset
+
     def serialize(self, with_witness=False):
         r = b""
-        r += super(CBlock, self).serialize()
+        r += self.serialize_header()
         if with_witness:
             r += ser_vector(self.vtx, "serialize_with_witness")
         else:
@@ -664,11 +854,17 @@ class CBlock(CBlockHeader):
         return uint256_from_str(hashes[0])
 
     def calc_merkle_root(self):
-        hashes = []
-        for tx in self.vtx:
-            tx.calc_sha256()
-            hashes.append(ser_uint256(tx.sha256))
-        return self.get_merkle_root(hashes)
+        # The cached txids are the leaves (tx.rehash() refreshes them after
+        # an in-place change), so only new, replaced or rehashed
+        # transactions touch the tree
+        txids = [tx.sha256 for tx in self.vtx]
+        if None in txids:
+            for i, tx in enumerate(self.vtx):
+                if txids[i] is None:
+                    tx.calc_sha256()
+                    txids[i] = tx.sha256
+        self.merkle_tree.update_uint256(txids)
+        return uint256_from_str(self.merkle_tree.root())
 
     def calc_witness_merkle_root(self):
         # For witness root purposes, the hash of the
@@ -679,7 +875,14 @@ class CBlock(CBlockHeader):
             # Calculate the hashes with witness data
             hashes.append(ser_uint256(tx.calc_sha256(True)))
 
-        return self.get_merkle_root(hashes)
+        self.witness_merkle_tree.update(hashes)
+        return uint256_from_str(self.witness_merkle_tree.root())
+
+    # Merkle branch proving the inclusion of vtx[index] (see
+    # MerkleTree.root_from_branch)
+    def get_merkle_branch(self, index):
+        self.calc_merkle_root()
+        return self.merkle_tree.branch(index)
 
     def is_valid(self):
         self.calc_sha256()
@@ -693,12 +896,24 @@ class CBlock(CBlockHeader):
             return False
         return True
 
-    def solve(self):
+    # Increment nNonce until the block hash meets its nBits target.
+    # processes: grind with this many worker processes (None for one per
+    # core) instead of in this process; only worth it for hard targets.
+    def solve(self, processes=1):
         self.rehash()
         target = uint256_from_compact(self.nBits)
-        while self.sha256 > target:
-            self.nNonce += 1
-            self.rehash()
+        if self.sha256 <= target:
+            return
+        header = self.serialize_header()
+        if processes == 1:
+            nonce = solve_header_nonce(header, target, self.nNonce + 1)
+        else:
+            nonce = solve_header_nonce_parallel(header, target, self.nNonce + 1,
+                                                processes=processes)
+        if nonce is None:
+            raise ValueError("no nonce solves block %064x" % self.sha256)
+        self.nNonce = nonce
+        self.rehash()
 
     def __repr__(self):
         return "CBlock(nVersion=%i hashPrevBlock=%064x hashMerkleRoot=%064x nTime=%s nBits=%08x nNonce=%08x vtx=%s)" \
@@ -955,6 +1170,9 @@ class msg_tx(object):
     def deserialize(self, f):
         self.tx.deserialize(f)
 
+    def deserialize_from(self, buf, offset):
+        return self.tx.deserialize_from(buf, offset)
+
     def serialize(self):
         return self.tx.serialize_without_witness()
 
@@ -979,6 +1197,9 @@ class msg_block(object):
     def deserialize(self, f):
         self.block.deserialize(f)
 
+    def deserialize_from(self, buf, offset):
+        return self.block.deserialize_from(buf, offset)
+
     def serialize(self):
         return self.block.serialize()
 
@@ -1140,13 +1361,20 @@ class msg_headers(object):
 
     def deserialize(self, f):
         # comment in navcoind indicates these should be deserialized as blocks
-        blocks = deser_vector(f, CBlock)
-        for x in blocks:
-            self.headers.append(CBlockHeader(x))
+        for i in range(deser_compact_size(f)):
+            header = CBlockHeader()
+            header.deserialize(f)
+            deser_vector(f, CTransaction)
+            header.calc_sha256()
+            self.headers.append(header)
 
     def serialize(self):
-        blocks = [CBlock(x) for x in self.headers]
-        return ser_vector(blocks)
+        # Each header goes out as a block with an empty vtx
+        r = [ser_compact_size(len(self.headers))]
+        for x in self.headers:
+            r.append(x.serialize_header())
+            r.append(b"\x00")
+        return b"".join(r)
 
     def __repr__(self):
         return "msg_headers(headers=%s)" % repr(self.headers)
@@ -1184,19 +1412,23 @@ class msg_reject(object):
             % (self.message, self.code, self.reason, self.data)
 
 # Helper function
-def wait_until(predicate, attempts=float('inf'), timeout=float('inf')):
-    attempt = 0
-    elapsed = 0
-
-    while attempt < attempts and elapsed < timeout:
-        with mininode_lock:
-            if predicate():
-                return True
-        attempt += 1
-        elapsed += 0.05
-        time.sleep(0.05)
-
-    return False
+# Wait until predicate() is true, re-evaluating it (with cond's lock held)
+# each time cond is notified.  cond defaults to mininode_cond; pass a
+# NodeConnCB's cond for callbacks with their own lock.  attempts is kept for
+# compatibility with the old 50ms polling loop and bounds the wait to
+# attempts * 50ms.
+def wait_until(predicate, attempts=float('inf'), timeout=float('inf'), cond=None):
+    if cond is None:
+        cond = mininode_cond
+    deadline = time.time() + min(timeout, attempts * 0.05)
+
+    with cond:
+        while not predicate():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            cond.wait(min(remaining, WAIT_RECHECK_INTERVAL))
+    return True
 
 class msg_feefilter(object):
     command = b"feefilter"
@@ -1218,44 +1450,69 @@ class msg_feefilter(object):
 # This is what a callback should look like for NodeConn
 # Reimplement the on_* functions to provide handling for events
 class NodeConnCB(object):
-    def __init__(self):
+    # own_lock: guard this callback's state with a new RLock instead of the
+    # shared mininode_lock (see mininode_lock).
+    def __init__(self, own_lock=False):
+        if own_lock:
+            self.lock = RLock()
+            self.cond = Condition(self.lock)
+        else:
+            self.lock = mininode_lock
+            self.cond = mininode_cond
         self.verack_received = False
         # deliver_sleep_time is helpful for debugging race conditions in p2p
-        # tests; it causes message delivery to sleep for the specified time
-        # before acquiring the global lock and delivering the next message.
+        # tests; it delays the delivery of each message by the specified
+        # time, before the callback's lock is acquired.  The network thread
+        # keeps serving other connections meanwhile.
         self.deliver_sleep_time = None
         # Remember the services our peer has advertised
         self.peer_services = None
+        # Futures waiting for the next message of a command (see
+        # message_future)
+        self.message_futures = {}
 
     def set_deliver_sleep_time(self, value):
-        with mininode_lock:
+        with self.lock:
             self.deliver_sleep_time = value
 
     def get_deliver_sleep_time(self):
-        with mininode_lock:
+        with self.lock:
             return self.deliver_sleep_time
 
     # Spin until verack message is received from the node.
     # Tests may want to use this as a signal that the test can begin.
     # This can be called from the testing thread, so it needs to acquire the
-    # global lock.
+    # callback's lock.
     def wait_for_verack(self):
-        while True:
-            with mininode_lock:
-                if self.verack_received:
-                    return
-            time.sleep(0.05)
-
+        wait_until(lambda: self.verack_received, cond=self.cond)
+
+    # Coroutine version of wait_for_verack, to be run on the network thread
+    # (see run_on_network_thread).
+    async def async_wait_for_verack(self):
+        if not self.verack_received:
+            await self.message_future(b"verack")
+
+    # Return an asyncio future, bound to the network thread's event loop,
+    # that completes with the next message of the given command delivered to
+    # this callback (after its on_* handler ran).
+    def message_future(self, command):
+        with self.lock:
+            future = mininode_loop.create_future()
+            self.message_futures.setdefault(command, []).append(future)
+        return future
+
+    # Called on the network thread with self.lock held (see
+    # NodeConn.deliver_queued)
     def deliver(self, conn, message):
-        deliver_sleep = self.get_deliver_sleep_time()
-        if deliver_sleep is not None:
-            time.sleep(deliver_sleep)
-        with mininode_lock:
-            try:
-                getattr(self, 'on_' + message.command.decode('ascii'))(conn, message)
-            except:
-                print("ERROR delivering %s (%s)" % (repr(message),
-                                                    sys.exc_info()[0]))
+        try:
+            getattr(self, 'on_' + message.command.decode('ascii'))(conn, message)
+        except:
+            print("ERROR delivering %s (%s)" % (repr(message),
+                                                sys.exc_info()[0]))
+        for future in self.message_futures.pop(message.command, []):
+            if not future.done():
+                future.set_result(message)
+        self.cond.notify_all()
 
     def on_version(self, conn, message):
         if message.nVersion >= 209:
@@ -1298,8 +1555,8 @@ class NodeConnCB(object):
 
 # More useful callbacks and functions for NodeConnCB's which have a single NodeConn
 class SingleNodeConnCB(NodeConnCB):
-    def __init__(self):
-        NodeConnCB.__init__(self)
+    def __init__(self, own_lock=False):
+        NodeConnCB.__init__(self, own_lock)
         self.connection = None
         self.ping_counter = 1
         self.last_pong = msg_pong()
@@ -1319,13 +1576,37 @@ class SingleNodeConnCB(NodeConnCB):
         def received_pong():
             return (self.last_pong.nonce == self.ping_counter)
         self.send_message(msg_ping(nonce=self.ping_counter))
-        success = wait_until(received_pong, timeout)
+        success = wait_until(received_pong, timeout, cond=self.cond)
         self.ping_counter += 1
         return success
 
+    # Coroutine version of sync_with_ping, to be run on the network thread
+    async def async_sync_with_ping(self, timeout=30):
+        nonce = self.ping_counter
+        self.ping_counter += 1
+        deadline = time.time() + timeout
+        pong = self.message_future(b"pong")
+        self.send_message(msg_ping(nonce=nonce))
+        try:
+            while (await asyncio.wait_for(pong, deadline - time.time())).nonce != nonce:
+                pong = self.message_future(b"pong")
+        except asyncio.TimeoutError:
+            return False
+        return True
+
 # The actual NodeConn class
-# This class provides an interface for a p2p connection to a specified node
-class NodeConn(asyncore.dispatcher):
+# This class provides an interface for a p2p connection to a specified node.
+# It is an asyncio protocol driven by the NetworkThread's event loop; every
+# method except send_message() and disconnect_node() runs on that thread.
+#
+# Received data is read straight into recvbuf (see get_buffer), a bytearray
+# with read (recv_start) and write (recv_end) cursors.  Parsed messages only
+# advance recv_start; the unread tail is moved back to the front when space
+# runs out, so each byte is copied a bounded number of times however many
+# messages are in flight.  Outgoing messages are queued as chunks in
+# send_queue and handed to the transport with one writelines() per loop
+# iteration.
+class NodeConn(asyncio.BufferedProtocol):
     messagemap = {
         b"version": msg_version,
         b"verack": msg_verack,
@@ -1351,15 +1632,27 @@ class NodeConn(asyncore.dispatcher):
         "testnet3": b"\x0b\x11\x09\x07",  # testnet3
         "regtest": b"\xfa\xbf\xb5\xda",   # regtest
     }
+    # Minimum free space offered to the transport for each read
+    RECV_CHUNK_SIZE = 256 * 1024
 
     def __init__(self, dstaddr, dstport, rpc, callback, net="regtest", services=NODE_NETWORK):
-        asyncore.dispatcher.__init__(self, map=mininode_socket_map)
         self.log = logging.getLogger("NodeConn(%s:%d)" % (dstaddr, dstport))
         self.dstaddr = dstaddr
         self.dstport = dstport
-        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sendbuf = b""
-        self.recvbuf = b""
+        self.transport = None
+        self.recvbuf = bytearray(self.RECV_CHUNK_SIZE)
+        self.recv_start = 0
+        self.recv_end = 0
+        # Bytes needed to complete the message being received, if known
+        self.recv_need = 0
+        # Messages received but not yet delivered to the callback
+        self.recv_queue = deque()
+        self.deliver_scheduled = False
+        # When the first queued message is due, if the callback has a
+        # deliver_sleep_time
+        self.deliver_at = None
+        self.send_queue = deque()
+        self.flush_scheduled = False
         self.ver_send = 209
         self.ver_recv = 209
         self.last_sent = 0
@@ -1368,8 +1661,9 @@ class NodeConn(asyncore.dispatcher):
         self.cb = callback
         self.disconnect = False
         self.nServices = 0
+        self.rpc = rpc
 
-        # stuff version msg into sendbuf
+        # stuff version msg into send_queue
         vt = msg_version()
         vt.nServices = services
         vt.addrTo.ip = self.dstaddr
@@ -1380,96 +1674,140 @@ class NodeConn(asyncore.dispatcher):
         print('MiniNode: Connecting to NavCoin Node IP # ' + dstaddr + ':' \
             + str(dstport))
 
-        try:
-            self.connect((dstaddr, dstport))
-        except:
-            self.handle_close()
-        self.rpc = rpc
-
-    def show_debug_msg(self, msg):
-        self.log.debug(msg)
+        with mininode_lock:
+            mininode_socket_map[id(self)] = self
+            if mininode_loop is not None:
+                mininode_loop.call_soon_threadsafe(self.start_connect, mininode_loop)
+
+    # msg is only %-formatted with args if debug logging is enabled, so
+    # large messages aren't repr()'d for nothing
+    def show_debug_msg(self, msg, *args):
+        self.log.debug(msg, *args)
+
+    # Called on the network thread once its event loop is running
+    def start_connect(self, loop):
+        async def connect():
+            try:
+                await loop.create_connection(lambda: self, self.dstaddr, self.dstport)
+            except OSError:
+                self.handle_close()
+        loop.create_task(connect())
 
-    def handle_connect(self):
+    def connection_made(self, transport):
         self.show_debug_msg("MiniNode: Connected & Listening: \n")
+        self.transport = transport
         self.state = "connected"
+        # Flush whatever was queued up before the connection existed
+        self.flush_send_queue()
+        with self.cb.cond:
+            self.cb.cond.notify_all()
+
+    # Also called once a transport closed by handle_close() has written out
+    # what was queued on it and closed its socket
+    def connection_lost(self, exc):
+        self.transport = None
+        if self.state == "closed":
+            self.forget()
+        else:
+            self.handle_close()
 
     def handle_close(self):
+        if self.state == "closed":
+            return
         self.show_debug_msg("MiniNode: Closing Connection to %s:%d... "
                             % (self.dstaddr, self.dstport))
-        self.state = "closed"
-        self.recvbuf = b""
-        self.sendbuf = b""
-        try:
-            self.close()
-        except:
-            pass
-        self.cb.on_close(self)
-
-    def handle_read(self):
-        try:
-            t = self.recv(8192)
-            if len(t) > 0:
-                self.recvbuf += t
-                self.got_data()
-        except:
-            pass
-
-    def readable(self):
-        return True
-
-    def writable(self):
         with mininode_lock:
-            length = len(self.sendbuf)
-        return (length > 0)
+            self.state = "closed"
+            self.recv_start = self.recv_end = self.recv_need = 0
+            self.recv_queue.clear()
+            self.send_queue.clear()
+        if self.transport is not None:
+            # Only forgotten in connection_lost, so the loop keeps running
+            # until the socket is actually closed
+            self.transport.close()
+        else:
+            self.forget()
+        self.cb.on_close(self)
+        with self.cb.cond:
+            self.cb.cond.notify_all()
 
-    def handle_write(self):
+    # Drop a closed connection from mininode_socket_map; the network thread's
+    # event loop stops with the last one
+    def forget(self):
         with mininode_lock:
-            try:
-                sent = self.send(self.sendbuf)
-            except:
-                self.handle_close()
-                return
-            self.sendbuf = self.sendbuf[sent:]
+            mininode_socket_map.pop(id(self), None)
+            if not mininode_socket_map and mininode_loop is not None:
+                mininode_loop.stop()
+
+    def get_buffer(self, sizehint):
+        want = max(self.RECV_CHUNK_SIZE, self.recv_need)
+        if len(self.recvbuf) - self.recv_end < want:
+            # Move the unread data to the front ...
+            unread = self.recv_end - self.recv_start
+            if self.recv_start:
+                self.recvbuf[:unread] = self.recvbuf[self.recv_start:self.recv_end]
+                self.recv_start = 0
+                self.recv_end = unread
+            # ... and grow if that didn't free enough space
+            if len(self.recvbuf) - unread < want:
+                self.recvbuf.extend(bytes(max(want, len(self.recvbuf))))
+        return memoryview(self.recvbuf)[self.recv_end:]
+
+    def buffer_updated(self, nbytes):
+        global mininode_bytes_recv
+        mininode_bytes_recv += nbytes
+        self.recv_end += nbytes
+        self.got_data()
 
     def got_data(self):
         try:
             while True:
-                if len(self.recvbuf) < 4:
+                buf = self.recvbuf
+                pos = self.recv_start
+                avail = self.recv_end - pos
+                if avail < 4:
                     return
-                if self.recvbuf[:4] != self.MAGIC_BYTES[self.network]:
-                    raise ValueError("got garbage %s" % repr(self.recvbuf))
+                if buf[pos:pos+4] != self.MAGIC_BYTES[self.network]:
+                    raise ValueError("got garbage %s" % repr(buf[pos:self.recv_end]))
                 if self.ver_recv < 209:
-                    if len(self.recvbuf) < 4 + 12 + 4:
+                    hdrlen = 4 + 12 + 4
+                    if avail < hdrlen:
                         return
-                    command = self.recvbuf[4:4+12].split(b"\x00", 1)[0]
-                    msglen = struct.unpack("<i", self.recvbuf[4+12:4+12+4])[0]
                     checksum = None
-                    if len(self.recvbuf) < 4 + 12 + 4 + msglen:
-                        return
-                    msg = self.recvbuf[4+12+4:4+12+4+msglen]
-                    self.recvbuf = self.recvbuf[4+12+4+msglen:]
                 else:
-                    if len(self.recvbuf) < 4 + 12 + 4 + 4:
+                    hdrlen = 4 + 12 + 4 + 4
+                    if avail < hdrlen:
                         return
-                    command = self.recvbuf[4:4+12].split(b"\x00", 1)[0]
-                    msglen = struct.unpack("<i", self.recvbuf[4+12:4+12+4])[0]
-                    checksum = self.recvbuf[4+12+4:4+12+4+4]
-                    if len(self.recvbuf) < 4 + 12 + 4 + 4 + msglen:
-                        return
-                    msg = self.recvbuf[4+12+4+4:4+12+4+4+msglen]
+                    checksum = buf[pos+4+12+4:pos+hdrlen]
+                command = buf[pos+4:pos+4+12].split(b"\x00", 1)[0]
+                msglen = struct.unpack_from("<i", buf, pos+4+12)[0]
+                if avail < hdrlen + msglen:
+                    self.recv_need = hdrlen + msglen
+                    return
+                # Copied once, through a view; released straight away so
+                # recvbuf can still be resized
+                with memoryview(buf) as view:
+                    msg = bytes(view[pos+hdrlen:pos+hdrlen+msglen])
+                if checksum is not None:
                     th = sha256(msg)
                     h = sha256(th)
                     if checksum != h[:4]:
-                        raise ValueError("got bad checksum " + repr(self.recvbuf))
-                    self.recvbuf = self.recvbuf[4+12+4+4+msglen:]
+                        raise ValueError("got bad checksum " + repr(buf[pos:self.recv_end]))
+                self.recv_start = pos + hdrlen + msglen
+                self.recv_need = 0
+                if self.recv_start == self.recv_end:
+                    self.recv_start = self.recv_end = 0
+                command = bytes(command)
                 if command in self.messagemap:
-                    f = BytesIO(msg)
                     t = self.messagemap[command]()
-                    t.deserialize(f)
+                    if hasattr(t, 'deserialize_from'):
+                        # Large payloads (blocks, txs) are parsed in place
+                        t.deserialize_from(memoryview(msg), 0)
+                    else:
+                        t.deserialize(BytesIO(msg))
                     self.got_message(t)
                 else:
-                    self.show_debug_msg("Unknown command: '" + command + "' " +
-                                        repr(msg))
+                    self.show_debug_msg("Unknown command: %r %r", command, msg)
         except Exception as e:
             print('got_data:', repr(e))
             # import  traceback
@@ -1478,21 +1816,43 @@ class NodeConn(asyncore.dispatcher):
     def send_message(self, message, pushbuf=False):
         if self.state != "connected" and not pushbuf:
             raise IOError('Not connected, no pushbuf')
-        self.show_debug_msg("Send %s" % repr(message))
+        self.show_debug_msg("Send %r", message)
         command = message.command
         data = message.serialize()
-        tmsg = self.MAGIC_BYTES[self.network]
-        tmsg += command
-        tmsg += b"\x00" * (12 - len(command))
-        tmsg += struct.pack("<I", len(data))
         if self.ver_send >= 209:
             th = sha256(data)
             h = sha256(th)
-            tmsg += h[:4]
-        tmsg += data
-        with mininode_lock:
-            self.sendbuf += tmsg
-            self.last_sent = time.time()
+            header = struct.pack("<4s12sI4s", self.MAGIC_BYTES[self.network],
+                                 command, len(data), h[:4])
+        else:
+            header = struct.pack("<4s12sI", self.MAGIC_BYTES[self.network],
+                                 command, len(data))
+        # No lock needed: deque.append is atomic, and flush_send_queue clears
+        # flush_scheduled before draining, so a message appended here is
+        # either seen by a pending flush or schedules a new one.  Until the
+        # connection is made, connection_made() flushes the queue.
+        self.send_queue.append((header, data))
+        self.last_sent = time.time()
+        if self.transport is not None and not self.flush_scheduled:
+            # Transports aren't thread-safe; hand the write to the loop
+            self.flush_scheduled = True
+            mininode_loop.call_soon_threadsafe(self.flush_send_queue)
+
+    # Called on the network thread
+    def flush_send_queue(self):
+        global mininode_bytes_sent
+        self.flush_scheduled = False
+        if self.transport is None:
+            return
+        chunks = []
+        try:
+            while True:
+                chunks.extend(self.send_queue.popleft())
+        except IndexError:
+            pass
+        if chunks:
+            mininode_bytes_sent += sum(len(c) for c in chunks)
+            self.transport.writelines(chunks)
 
     def got_message(self, message):
         if message.command == b"version":
@@ -1500,25 +1860,77 @@ class NodeConn(asyncore.dispatcher):
                 self.messagemap[b'ping'] = msg_ping_prebip31
         if self.last_sent + 30 * 60 < time.time():
             self.send_message(self.messagemap[b'ping']())
-        self.show_debug_msg("Recv %s" % repr(message))
-        self.cb.deliver(self, message)
+        self.show_debug_msg("Recv %r", message)
+        self.recv_queue.append(message)
+        # A scheduled delivery will pick the message up, in order
+        if not self.deliver_scheduled:
+            self.deliver_queued()
+
+    # Deliver queued messages, in order, for as long as the callback's lock
+    # can be taken without waiting; otherwise retry shortly, so that a test
+    # thread holding this callback's lock doesn't stall other connections.
+    # The callback's deliver_sleep_time is waited for on the event loop too.
+    def deliver_queued(self):
+        self.deliver_scheduled = False
+        while self.recv_queue:
+            # A plain read; taking the lock here could block the loop
+            deliver_sleep = self.cb.deliver_sleep_time
+            if deliver_sleep is not None:
+                now = time.time()
+                if self.deliver_at is None:
+                    self.deliver_at = now + deliver_sleep
+                if now < self.deliver_at:
+                    self.schedule_deliver(self.deliver_at - now)
+                    return
+            if not self.cb.lock.acquire(blocking=False):
+                self.schedule_deliver(0.001)
+                return
+            self.deliver_at = None
+            try:
+                self.cb.deliver(self, self.recv_queue.popleft())
+            finally:
+                self.cb.lock.release()
+
+    def schedule_deliver(self, delay):
+        if not self.deliver_scheduled:
+            self.deliver_scheduled = True
+            mininode_loop.call_later(delay, self.deliver_queued)
 
     def disconnect_node(self):
         self.disconnect = True
+        with mininode_lock:
+            if mininode_loop is not None:
+                mininode_loop.call_soon_threadsafe(self.handle_close)
 
 
 class NetworkThread(Thread):
     def run(self):
-        while mininode_socket_map:
-            # We check for whether to disconnect outside of the asyncore
-            # loop to workaround the behavior of asyncore when using
-            # select
-            disconnected = []
-            for fd, obj in mininode_socket_map.items():
+        global mininode_loop
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        with mininode_lock:
+            if not mininode_socket_map:
+                loop.close()
+                return
+            mininode_loop = loop
+            for obj in list(mininode_socket_map.values()):
                 if obj.disconnect:
-                    disconnected.append(obj)
-            [ obj.handle_close() for obj in disconnected ]
-            asyncore.loop(0.1, use_poll=True, map=mininode_socket_map, count=1)
+                    obj.handle_close()
+                else:
+                    obj.start_connect(loop)
+        # Runs until the last connection is closed (see NodeConn.handle_close)
+        loop.run_forever()
+        with mininode_lock:
+            mininode_loop = None
+        loop.close()
+
+
+# Run a coroutine (e.g. NodeConnCB.async_wait_for_verack()) on the network
+# thread's event loop and wait for its result from the calling thread.
+def run_on_network_thread(coro, timeout=None):
+    with mininode_lock:
+        loop = mininode_loop
+    return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
 
 
 # An exception we can raise if we detect a potential disconnect
@@ -5,9 +5,14 @@
 
 # Base class for RPC testing
 
+import json
 import logging
 import optparse
 import os
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
 import sys
 import shutil
 import tempfile
@@ -23,9 +28,11 @@ from .util import (
     stop_node,
     wait_navcoinds,
     enable_coverage,
+    enable_resource_usage,
     check_json_precision,
     initialize_chain_clean,
     PortSeed,
+    DEFAULT_CHAIN,
 )
 from .authproxy import JSONRPCException
 
@@ -35,6 +42,8 @@ class NavCoinTestFramework(object):
     def __init__(self):
         self.num_nodes = 4
         self.setup_clean_chain = False
+        # The cached chain setup_chain starts from (see util.DEFAULT_CHAIN)
+        self.chain = DEFAULT_CHAIN
         self.nodes = None
 
     def run_test(self):
@@ -48,7 +57,7 @@ class NavCoinTestFramework(object):
         if self.setup_clean_chain:
             initialize_chain_clean(self.options.tmpdir, self.num_nodes)
         else:
-            initialize_chain(self.options.tmpdir, self.num_nodes)
+            initialize_chain(self.options.tmpdir, self.num_nodes, self.chain)
 
     def stop_node(self, num_node):
         stop_node(self.nodes[num_node], num_node)
@@ -103,6 +112,36 @@ class NavCoinTestFramework(object):
         wait_navcoinds()
         self.setup_network(False)
 
+    def write_resource_usage(self, filename):
+        """
+        Write the CPU time and peak RSS of this process and of each navcoind
+        it stopped, the RPC calls made and the P2P traffic, as JSON.  The
+        CPU time and peak RSS of this process are left out where the
+        resource module is unavailable (Windows).
+        """
+        from . import coverage, util
+        usage = {
+            "rpc_calls": sum(coverage.rpc_call_counts.values()),
+            "rpc_calls_by_method": dict(coverage.rpc_call_counts),
+            "navcoinds": util.navcoind_usage,
+        }
+        if resource is not None:
+            rusage = resource.getrusage(resource.RUSAGE_SELF)
+            usage["cpu_user"] = rusage.ru_utime
+            usage["cpu_system"] = rusage.ru_stime
+            # ru_maxrss is in bytes on macOS and in kB elsewhere
+            if sys.platform == "darwin":
+                usage["peak_rss_kb"] = rusage.ru_maxrss // 1024
+            else:
+                usage["peak_rss_kb"] = rusage.ru_maxrss
+        # Only if the test used mininode at all
+        mininode = sys.modules.get(__package__ + ".mininode")
+        if mininode:
+            usage["mininode_bytes_sent"] = mininode.mininode_bytes_sent
+            usage["mininode_bytes_recv"] = mininode.mininode_bytes_recv
+        with open(filename, 'w', encoding='utf8') as f:
+            json.dump(usage, f, indent=1, sort_keys=True)
+
     def main(self):
 
         parser = optparse.OptionParser(usage="%prog [options]")
@@ -120,6 +159,8 @@ class NavCoinTestFramework(object):
                           help="The seed to use for assigning port numbers (default: current process id)")
         parser.add_option("--coveragedir", dest="coveragedir",
                           help="Write tested RPC commands into this directory")
+        parser.add_option("--resourcefile", dest="resourcefile",
+                          help="Write the resources used by the test and its navcoinds into this JSON file")
         self.add_options(parser)
         (self.options, self.args) = parser.parse_args()
 
@@ -131,6 +172,9 @@ class NavCoinTestFramework(object):
         if self.options.coveragedir:
             enable_coverage(self.options.coveragedir)
 
+        if self.options.resourcefile:
+            enable_resource_usage()
+
         PortSeed.n = self.options.port_seed
 
         os.environ['PATH'] = self.options.srcdir+":"+self.options.srcdir+"/qt:"+os.environ['PATH']
@@ -177,6 +221,9 @@ class NavCoinTestFramework(object):
         else:
             print("Not cleaning up dir %s" % self.options.tmpdir)
 
+        if self.options.resourcefile:
+            self.write_resource_usage(self.options.resourcefile)
+
         if success:
             print("Tests successful")
             sys.exit(0)
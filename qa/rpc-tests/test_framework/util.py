@@ -8,6 +8,8 @@
 # Helpful routines for regression testing
 #
 
+import asyncio
+import hashlib
 import os
 import sys
 
@@ -22,12 +24,22 @@ import subprocess
 import time
 import re
 import errno
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
 
 from . import coverage
-from .authproxy import AuthServiceProxy, JSONRPCException
+from .authproxy import AuthServiceProxy, AsyncAuthServiceProxy, JSONRPCException
 
 COVERAGE_DIR = None
 
+# Resources used by each navcoind, noted just before it is stopped (see
+# record_navcoind_usage), if enabled with enable_resource_usage
+RECORD_RESOURCE_USAGE = False
+navcoind_usage = []
+
 # The maximum number of nodes a single test can spawn
 MAX_NODES = 8
 # Don't assign rpc or p2p ports lower than this
@@ -37,6 +49,17 @@ PORT_RANGE = 5000
 
 NAVCOIND_PROC_WAIT_TIMEOUT = 60
 
+# ioctl to reflink a file (linux/fs.h), see clone_file
+FICLONE = 0x40049409
+
+# navcoind logs this once it is fully initialized (see wait_for_navcoinds_start)
+INIT_DONE_LOG_LINE = b"init message: Done loading"
+# How often wait_for_navcoinds_start checks the nodes' logs, in seconds
+READY_CHECK_INTERVAL = 0.02
+# Blocks per generate call in fast_gen, and per batch when it sets mocktime
+FAST_GEN_CHUNK = 1000
+FAST_GEN_BATCH = 250
+
 
 class PortSeed:
     # Must be initialized with a unique integer for each process
@@ -68,8 +91,78 @@ def enable_coverage(dirname):
     global COVERAGE_DIR
     COVERAGE_DIR = dirname
 
+def enable_resource_usage():
+    """Note the resources used by each navcoind in navcoind_usage."""
+    global RECORD_RESOURCE_USAGE
+    RECORD_RESOURCE_USAGE = True
+
+def process_usage(pid):
+    """
+    CPU time (seconds) and peak RSS (kB) of a running process so far, from
+    /proc; empty where that isn't available.
+    """
+    try:
+        with open("/proc/%d/stat" % pid) as f:
+            # Skip past the command name, which may contain spaces
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/%d/status" % pid) as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return {}
+    ticks = os.sysconf("SC_CLK_TCK")
+    usage = {
+        "cpu_user": int(fields[11]) / ticks,
+        "cpu_system": int(fields[12]) / ticks,
+    }
+    if "VmHWM" in status:
+        usage["peak_rss_kb"] = int(status["VmHWM"].split()[0])
+    return usage
+
+def record_navcoind_usage(node, i):
+    """
+    Add the resources navcoind i has used so far, and its P2P traffic, to
+    navcoind_usage.  Called when stopping it.
+    """
+    usage = { "node": i }
+    if i in navcoind_processes:
+        usage["pid"] = navcoind_processes[i].pid
+        usage.update(process_usage(navcoind_processes[i].pid))
+    try:
+        # Bypass the coverage wrapper: this isn't a call the test made
+        totals = getattr(node, "auth_service_proxy_instance", node).getnettotals()
+        usage["p2p_bytes_sent"] = totals["totalbytessent"]
+        usage["p2p_bytes_recv"] = totals["totalbytesrecv"]
+    except (IOError, http.client.HTTPException, JSONRPCException):
+        pass
+    navcoind_usage.append(usage)
+
+
+def get_async_rpc_proxy(url, timeout=None):
+    """
+    Args:
+        url (str): URL of the RPC server to call
+
+    Kwargs:
+        timeout (int): HTTP timeout in seconds
+
+    Returns:
+        AsyncAuthServiceProxy. Calls aren't recorded for coverage.
+
+    """
+    proxy_kwargs = {}
+    if timeout is not None:
+        proxy_kwargs['timeout'] = timeout
+
+    proxy = AsyncAuthServiceProxy(url, **proxy_kwargs)
+    proxy.url = url  # store URL on proxy for info
+    return proxy
+
+def get_async_rpc_proxies(nodes, timeout=None):
+    """Return an AsyncAuthServiceProxy for each of the nodes' RPC proxies."""
+    return [ get_async_rpc_proxy(node.url, timeout) for node in nodes ]
 
-def get_rpc_proxy(url, node_number, timeout=None):
+
+def get_rpc_proxy(url, node_number, timeout=None, pool_size=None):
     """
     Args:
         url (str): URL of the RPC server to call
@@ -77,6 +170,8 @@ def get_rpc_proxy(url, node_number, timeout=None):
 
     Kwargs:
         timeout (int): HTTP timeout in seconds
+        pool_size (int): make calls over a pool of up to this many
+            connections, so the proxy can be shared between threads
 
     Returns:
         AuthServiceProxy. convenience object for making RPC calls.
@@ -85,6 +180,8 @@ def get_rpc_proxy(url, node_number, timeout=None):
     proxy_kwargs = {}
     if timeout is not None:
         proxy_kwargs['timeout'] = timeout
+    if pool_size is not None:
+        proxy_kwargs['pool_size'] = pool_size
 
     proxy = AuthServiceProxy(url, **proxy_kwargs)
     proxy.url = url  # store URL on proxy for info
@@ -150,6 +247,34 @@ def sync_mempools(rpc_connections, wait=1, timeout=60):
         timeout -= wait
     raise AssertionError("Mempool sync failed")
 
+# The async_* versions of the helpers above take AsyncAuthServiceProxy
+# connections (see get_async_rpc_proxies) and query all nodes concurrently.
+
+async def async_sync_blocks(rpc_connections, wait=1, timeout=60):
+    """
+    Wait until everybody has the same tip
+    """
+    while timeout > 0:
+        tips = await asyncio.gather(*[ x.getbestblockhash() for x in rpc_connections ])
+        if tips == [ tips[0] ]*len(tips):
+            return True
+        await asyncio.sleep(wait)
+        timeout -= wait
+    raise AssertionError("Block sync failed")
+
+async def async_sync_mempools(rpc_connections, wait=1, timeout=60):
+    """
+    Wait until everybody has the same transactions in their memory
+    pools
+    """
+    while timeout > 0:
+        pools = await asyncio.gather(*[ x.getrawmempool() for x in rpc_connections ])
+        if all(set(pool) == set(pools[0]) for pool in pools):
+            return True
+        await asyncio.sleep(wait)
+        timeout -= wait
+    raise AssertionError("Mempool sync failed")
+
 navcoind_processes = {}
 
 def initialize_datadir(dirname, n):
@@ -193,79 +318,233 @@ def wait_for_navcoind_start(process, url, i):
                 raise # unkown JSON RPC exception
         time.sleep(0.25)
 
-def initialize_chain(test_dir, num_nodes):
-    """
-    Create a cache of a 200-block-long chain (with wallet) for MAX_NODES
-    Afterward, create num_nodes copies from the cache
-    """
-
-    assert num_nodes <= MAX_NODES
-    create_cache = False
-    for i in range(MAX_NODES):
-        if not os.path.isdir(os.path.join('cache', 'node'+str(i))):
-            create_cache = True
-            break
-
-    if create_cache:
-
-        #find and delete old cache directories if any exist
-        for i in range(MAX_NODES):
-            if os.path.isdir(os.path.join("cache","node"+str(i))):
-                shutil.rmtree(os.path.join("cache","node"+str(i)))
-
-        # Create cache directories, run navcoinds:
-        for i in range(MAX_NODES):
-            datadir=initialize_datadir("cache", i)
-            args = [ os.getenv("NAVCOIND", "navcoind"), "-server", "-keypool=1", "-datadir="+datadir, "-discover=0" ]
-            if i > 0:
-                args.append("-connect=127.0.0.1:"+str(p2p_port(0)))
-            navcoind_processes[i] = subprocess.Popen(args)
-            if os.getenv("PYTHON_DEBUG", ""):
-                print("initialize_chain: navcoind started, waiting for RPC to come up")
-            wait_for_navcoind_start(navcoind_processes[i], rpc_url(i), i)
-            if os.getenv("PYTHON_DEBUG", ""):
-                print("initialize_chain: RPC succesfully started")
-
-        rpcs = []
-        for i in range(MAX_NODES):
+async def async_wait_for_navcoind_start(process, url, i):
+    '''
+    Coroutine version of wait_for_navcoind_start, so several nodes can be
+    waited for concurrently.
+    '''
+    while True:
+        if process.poll() is not None:
+            raise Exception('navcoind exited with status %i during initialization' % process.returncode)
+        rpc = get_async_rpc_proxy(url)
+        try:
+            blocks = await rpc.getblockcount()
+            break # break out of loop on success
+        except IOError as e:
+            if e.errno != errno.ECONNREFUSED: # Port not yet open?
+                raise # unknown IO error
+        except JSONRPCException as e: # Initialization phase
+            if e.error['code'] != -28: # RPC in warmup?
+                raise # unkown JSON RPC exception
+        finally:
+            rpc.close()
+        await asyncio.sleep(0.25)
+
+def build_default_chain(dirname, chain):
+    """
+    Build the default cached chain in dirname: a 200-block-long chain (with
+    wallet) for MAX_NODES, mined with mocktime
+    """
+    # Run navcoinds:
+    nodes = []
+    for i in range(chain["num_nodes"]):
+        datadir = os.path.join(dirname, "node"+str(i))
+        args = [ os.getenv("NAVCOIND", "navcoind"), "-server", "-keypool=1", "-datadir="+datadir, "-discover=0" ] + chain["extra_args"]
+        if i > 0:
+            args.append("-connect=127.0.0.1:"+str(p2p_port(0)))
+        logfile = log_filename(dirname, i, "debug.log")
+        nodes.append((i, rpc_url(i), logfile, launch_navcoind(i, args, logfile)))
+    if os.getenv("PYTHON_DEBUG", ""):
+        print("initialize_chain: navcoinds started, waiting for RPC to come up")
+    wait_for_navcoinds_start(nodes)
+    if os.getenv("PYTHON_DEBUG", ""):
+        print("initialize_chain: RPC succesfully started")
+
+    rpcs = []
+    for i in range(chain["num_nodes"]):
+        try:
+            rpcs.append(get_rpc_proxy(rpc_url(i), i))
+        except:
+            sys.stderr.write("Error connecting to "+rpc_url(i)+"\n")
+            sys.exit(1)
+
+    # Create a 200-block-long chain; each of the 4 first nodes
+    # gets 25 mature blocks and 25 immature.
+    # Note: To preserve compatibility with older versions of
+    # initialize_chain, only 4 nodes will generate coins.
+    #
+    # blocks are created with timestamps 10 minutes apart
+    # starting from 2010 minutes in the past
+    enable_mocktime()
+    block_time = get_mocktime() - (201 * 10 * 60)
+    for i in range(2):
+        for peer in range(4):
+            fast_gen(rpcs[peer], 25, block_time, 10*60, rpcs[:peer] + rpcs[peer+1:])
+            block_time += 25*10*60
+            # Must sync before next peer starts generating blocks
+            sync_blocks(rpcs)
+
+    # Shut them down
+    stop_nodes(rpcs)
+    wait_navcoinds()
+    disable_mocktime()
+
+# Chains kept in CHAIN_CACHE_DIR, built once by their "build" function and
+# then cloned for every test that uses them (see initialize_chain).
+# Everything but "build" and "max_age" identifies the chain: changing it, or
+# the navcoind binary, builds a new snapshot.  Bump "version" whenever
+# "build" changes how the chain is mined.  A snapshot older than "max_age"
+# seconds is rebuilt (chains mined without mocktime would otherwise put the
+# nodes in initial block download once their tip is a day old).
+DEFAULT_CHAIN = {
+    "name": "default",
+    "version": 2,
+    "num_nodes": MAX_NODES,
+    "blocks": 200,
+    "mocktime": True,
+    "extra_args": [],
+    "max_age": None,
+    "build": build_default_chain,
+}
+
+CHAIN_CACHE_DIR = "cache"
+# Written into a snapshot once it is complete
+CHAIN_SPEC_FILE = "chain.json"
+# Files a node leaves behind that aren't part of the chain
+CHAIN_SNAPSHOT_SKIP = [ "debug.log", "db.log", "peers.dat", "fee_estimates.dat" ]
+
+def navcoind_fingerprint():
+    """Identify the navcoind binary in use by its path, size and mtime"""
+    binary = os.getenv("NAVCOIND", "navcoind")
+    path = shutil.which(binary) or binary
+    try:
+        st = os.stat(path)
+    except OSError:
+        return [ path ]
+    return [ os.path.realpath(path), st.st_size, st.st_mtime_ns ]
+
+@contextmanager
+def chain_cache_lock(exclusive=False):
+    """
+    Hold the lock on CHAIN_CACHE_DIR: shared while a snapshot is cloned,
+    exclusive while snapshots are removed or moved in place.  There is no
+    locking where fcntl is unavailable.
+    """
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(CHAIN_CACHE_DIR, exist_ok=True)
+    with open(os.path.join(CHAIN_CACHE_DIR, ".lock"), 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def chain_snapshot_is_current(snapshot, chain):
+    spec_file = os.path.join(snapshot, CHAIN_SPEC_FILE)
+    if not os.path.isfile(spec_file):
+        return False
+    return chain["max_age"] is None or time.time() - os.path.getmtime(spec_file) < chain["max_age"]
+
+def build_chain_snapshot(chain, spec, snapshot):
+    """Build chain and move it in place as snapshot, replacing older ones"""
+    prefix = chain["name"] + "-"
+    # Build next to the snapshot and move it in place once complete, so a
+    # test running at the same time never sees half a chain
+    build_dir = snapshot + ".build-" + str(os.getpid())
+    shutil.rmtree(build_dir, ignore_errors=True)
+    for i in range(chain["num_nodes"]):
+        initialize_datadir(build_dir, i)
+    try:
+        chain["build"](build_dir, chain)
+    except:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+    for i in range(chain["num_nodes"]):
+        for name in CHAIN_SNAPSHOT_SKIP:
             try:
-                rpcs.append(get_rpc_proxy(rpc_url(i), i))
-            except:
-                sys.stderr.write("Error connecting to "+url+"\n")
-                sys.exit(1)
-
-        # Create a 200-block-long chain; each of the 4 first nodes
-        # gets 25 mature blocks and 25 immature.
-        # Note: To preserve compatibility with older versions of
-        # initialize_chain, only 4 nodes will generate coins.
-        #
-        # blocks are created with timestamps 10 minutes apart
-        # starting from 2010 minutes in the past
-        enable_mocktime()
-        block_time = get_mocktime() - (201 * 10 * 60)
-        for i in range(2):
-            for peer in range(4):
-                for j in range(25):
-                    set_node_times(rpcs, block_time)
-                    slow_gen(rpcs[peer], 1)
-                    block_time += 10*60
-                # Must sync before next peer starts generating blocks
-                sync_blocks(rpcs)
-
-        # Shut them down, and clean up cache directories:
-        stop_nodes(rpcs)
-        wait_navcoinds()
-        disable_mocktime()
-        for i in range(MAX_NODES):
-            os.remove(log_filename("cache", i, "debug.log"))
-            os.remove(log_filename("cache", i, "db.log"))
-            os.remove(log_filename("cache", i, "peers.dat"))
-            os.remove(log_filename("cache", i, "fee_estimates.dat"))
+                os.remove(log_filename(build_dir, i, name))
+            except FileNotFoundError:
+                pass
+    with open(os.path.join(build_dir, CHAIN_SPEC_FILE), 'w', encoding='utf8') as f:
+        json.dump(spec, f, sort_keys=True, indent=1)
+
+    # No test is cloning a snapshot while the lock is held exclusively
+    with chain_cache_lock(exclusive=True):
+        if chain_snapshot_is_current(snapshot, chain):
+            # Someone else finished the same snapshot first
+            shutil.rmtree(build_dir, ignore_errors=True)
+            return
+        # Drop the snapshots of this chain for other specs or binaries, or
+        # that have expired
+        for name in os.listdir(CHAIN_CACHE_DIR):
+            if name.startswith(prefix) and name[len(prefix):].isalnum():
+                shutil.rmtree(os.path.join(CHAIN_CACHE_DIR, name), ignore_errors=True)
+        os.rename(build_dir, snapshot)
+
+@contextmanager
+def locked_chain_snapshot(chain):
+    """
+    Yield the directory holding the snapshot of chain (see DEFAULT_CHAIN),
+    building it first if there is no up to date one.  The snapshot is not
+    removed by another test until the with block is left.
+    """
+    spec = dict((k, v) for k, v in chain.items() if k not in ("build", "max_age"))
+    spec["navcoind"] = navcoind_fingerprint()
+    key = hashlib.sha256(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    snapshot = os.path.join(CHAIN_CACHE_DIR, chain["name"] + "-" + key)
+    while True:
+        with chain_cache_lock():
+            if chain_snapshot_is_current(snapshot, chain):
+                yield snapshot
+                return
+        build_chain_snapshot(chain, spec, snapshot)
 
+def clone_file(from_file, to_file):
+    """
+    Copy a file out of a chain snapshot.  Leveldb tables (.ldb) are never
+    changed once written, so they are hardlinked; anything else could be
+    written to by navcoind and is reflinked (copy-on-write) where the
+    filesystem supports it, or copied.
+    """
+    if from_file.endswith(".ldb"):
+        try:
+            os.link(from_file, to_file)
+            return
+        except OSError:
+            pass
+    if fcntl is not None:
+        try:
+            with open(from_file, 'rb') as src, open(to_file, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            shutil.copymode(from_file, to_file)
+            return
+        except OSError:
+            pass
+    shutil.copy2(from_file, to_file)
+
+def clone_datadir(from_dir, to_dir):
+    for root, dirs, files in os.walk(from_dir):
+        target = os.path.join(to_dir, os.path.relpath(root, from_dir))
+        os.makedirs(target, exist_ok=True)
+        for name in files:
+            clone_file(os.path.join(root, name), os.path.join(target, name))
+
+def initialize_chain(test_dir, num_nodes, chain=DEFAULT_CHAIN):
+    """
+    Create num_nodes copies of the cached chain (DEFAULT_CHAIN, a
+    200-block-long chain with wallet, unless told otherwise), building the
+    cache first if needed
+    """
+
+    assert num_nodes <= chain["num_nodes"]
+    with locked_chain_snapshot(chain) as snapshot:
+        for i in range(num_nodes):
+            from_dir = os.path.join(snapshot, "node"+str(i))
+            to_dir = os.path.join(test_dir,  "node"+str(i))
+            clone_datadir(from_dir, to_dir)
     for i in range(num_nodes):
-        from_dir = os.path.join("cache", "node"+str(i))
-        to_dir = os.path.join(test_dir,  "node"+str(i))
-        shutil.copytree(from_dir, to_dir)
         initialize_datadir(test_dir, i) # Overwrite port/rpcport in navcoin.conf
 
 def initialize_chain_clean(test_dir, num_nodes):
@@ -297,48 +576,122 @@ def _rpchost_to_args(rpchost):
         rv += ['-rpcport=' + rpcport]
     return rv
 
-def start_node(i, dirname, extra_args=None, rpchost=None, timewait=None, binary=None):
+def launch_navcoind(i, args, logfile):
     """
-    Start a navcoind and return RPC connection to it
+    Start navcoind process i with the given arguments, without waiting for
+    it.  Returns the offset in its debug.log (logfile) where its output
+    starts, for wait_for_navcoinds_start.
+    """
+    try:
+        log_offset = os.path.getsize(logfile)
+    except OSError:
+        log_offset = 0
+    navcoind_processes[i] = subprocess.Popen(args)
+    return log_offset
+
+def wait_for_navcoinds_start(nodes):
+    """
+    Wait for several navcoinds to start, all at the same time.  nodes is a
+    list of (i, url, logfile, log_offset); see launch_navcoind.
+
+    A node is ready when it logs that initialization is done (which happens
+    right after RPC warmup ends), confirmed with a getblockcount call.
+    Checking for that only costs a stat() of the log, so it is done every
+    READY_CHECK_INTERVAL; nodes that don't log there are still found by
+    the RPC check every 0.25s, as before.
     """
+    pending = dict((i, [url, logfile, log_offset, 0]) for (i, url, logfile, log_offset) in nodes)
+    while pending:
+        now = time.time()
+        for i, state in list(pending.items()):
+            url, logfile, log_offset, next_rpc_check = state
+            process = navcoind_processes[i]
+            if process.poll() is not None:
+                raise Exception('navcoind exited with status %i during initialization' % process.returncode)
+            done_loading = False
+            try:
+                if os.path.getsize(logfile) > log_offset:
+                    with open(logfile, 'rb') as f:
+                        f.seek(log_offset)
+                        data = f.read()
+                    done_loading = INIT_DONE_LOG_LINE in data
+                    # Keep the last partial line for the next check
+                    state[2] = log_offset + max(data.rfind(b"\n") + 1, len(data) - len(INIT_DONE_LOG_LINE))
+            except OSError:
+                pass
+            if done_loading or now >= next_rpc_check:
+                try:
+                    get_rpc_proxy(url, i).getblockcount()
+                    del pending[i]
+                    continue
+                except IOError as e:
+                    if e.errno != errno.ECONNREFUSED: # Port not yet open?
+                        raise # unknown IO error
+                except JSONRPCException as e: # Initialization phase
+                    if e.error['code'] != -28: # RPC in warmup?
+                        raise # unkown JSON RPC exception
+                state[3] = now + 0.25
+        if pending:
+            time.sleep(READY_CHECK_INTERVAL)
+
+def navcoind_args(i, dirname, extra_args=None, binary=None):
     datadir = os.path.join(dirname, "node"+str(i))
     if binary is None:
         binary = os.getenv("NAVCOIND", "navcoind")
     args = [ binary, "-datadir="+datadir, "-server", "-keypool=1", "-discover=0", "-rest", "-mocktime="+str(get_mocktime()) ]
     if extra_args is not None: args.extend(extra_args)
-    navcoind_processes[i] = subprocess.Popen(args)
-    if os.getenv("PYTHON_DEBUG", ""):
-        print("start_node: navcoind started, waiting for RPC to come up")
-    url = rpc_url(i, rpchost)
-    wait_for_navcoind_start(navcoind_processes[i], url, i)
-    if os.getenv("PYTHON_DEBUG", ""):
-        print("start_node: RPC succesfully started")
-    proxy = get_rpc_proxy(url, i, timeout=timewait)
+    return args
 
-    if COVERAGE_DIR:
-        coverage.write_all_rpc_commands(COVERAGE_DIR, proxy)
-
-    return proxy
+def start_node(i, dirname, extra_args=None, rpchost=None, timewait=None, binary=None):
+    """
+    Start a navcoind and return RPC connection to it
+    """
+    return start_nodes(1, dirname, [extra_args], rpchost, [binary], timewait, first=i)[0]
 
-def start_nodes(num_nodes, dirname, extra_args=None, rpchost=None, binary=None):
+def start_nodes(num_nodes, dirname, extra_args=None, rpchost=None, binary=None, timewait=None, first=0):
     """
     Start multiple navcoinds, return RPC connections to them
+
+    All navcoinds are launched first and then waited for together.
     """
     if extra_args is None: extra_args = [ None for _ in range(num_nodes) ]
     if binary is None: binary = [ None for _ in range(num_nodes) ]
-    rpcs = []
+    nodes = []
     try:
-        for i in range(num_nodes):
-            rpcs.append(start_node(i, dirname, extra_args[i], rpchost, binary=binary[i]))
+        for n in range(num_nodes):
+            i = first + n
+            logfile = log_filename(dirname, i, "debug.log")
+            log_offset = launch_navcoind(i, navcoind_args(i, dirname, extra_args[n], binary[n]), logfile)
+            nodes.append((i, rpc_url(i, rpchost), logfile, log_offset))
+        if os.getenv("PYTHON_DEBUG", ""):
+            print("start_nodes: navcoinds started, waiting for RPC to come up")
+        wait_for_navcoinds_start(nodes)
+        if os.getenv("PYTHON_DEBUG", ""):
+            print("start_nodes: RPC succesfully started")
     except: # If one node failed to start, stop the others
-        stop_nodes(rpcs)
+        for (i, url, logfile, log_offset) in nodes:
+            if navcoind_processes[i].poll() is None:
+                navcoind_processes[i].terminate()
+            navcoind_processes[i].wait(timeout=NAVCOIND_PROC_WAIT_TIMEOUT)
+            del navcoind_processes[i]
         raise
+
+    rpcs = []
+    for (i, url, logfile, log_offset) in nodes:
+        proxy = get_rpc_proxy(url, i, timeout=timewait)
+
+        if COVERAGE_DIR:
+            coverage.write_all_rpc_commands(COVERAGE_DIR, proxy)
+
+        rpcs.append(proxy)
     return rpcs
 
 def log_filename(dirname, n_node, logname):
     return os.path.join(dirname, "node"+str(n_node), "devnet", logname)
 
 def stop_node(node, i):
+    if RECORD_RESOURCE_USAGE:
+        record_navcoind_usage(node, i)
     try:
         node.stop()
     except http.client.CannotSendRequest as e:
@@ -347,7 +700,9 @@ def stop_node(node, i):
     del navcoind_processes[i]
 
 def stop_nodes(nodes):
-    for node in nodes:
+    for i, node in enumerate(nodes):
+        if RECORD_RESOURCE_USAGE:
+            record_navcoind_usage(node, i)
         try:
             node.stop()
         except http.client.CannotSendRequest as e:
@@ -568,17 +923,24 @@ def create_confirmed_utxos(fee, node, count):
     addr2 = node.getnewaddress()
     if iterations <= 0:
         return utxos
-    for i in range(iterations):
-        t = utxos.pop()
-        inputs = []
-        inputs.append({ "txid" : t["txid"], "vout" : t["vout"]})
-        outputs = {}
-        send_value = t['amount'] - fee
-        outputs[addr1] = satoshi_round(send_value/2)
-        outputs[addr2] = satoshi_round(send_value/2)
-        raw_tx = node.createrawtransaction(inputs, outputs)
-        signed_tx = node.signrawtransaction(raw_tx)["hex"]
-        txid = node.sendrawtransaction(signed_tx)
+    # Create, sign and send the transactions one batch of RPC calls per step
+    with node.batch() as batch:
+        raw_txs = []
+        for i in range(iterations):
+            t = utxos.pop()
+            inputs = []
+            inputs.append({ "txid" : t["txid"], "vout" : t["vout"]})
+            outputs = {}
+            send_value = t['amount'] - fee
+            outputs[addr1] = satoshi_round(send_value/2)
+            outputs[addr2] = satoshi_round(send_value/2)
+            raw_txs.append(batch.createrawtransaction(inputs, outputs))
+    with node.batch() as batch:
+        signed_txs = [batch.signrawtransaction(raw_tx.result()) for raw_tx in raw_txs]
+    with node.batch() as batch:
+        for signed_tx in signed_txs:
+            batch.sendrawtransaction(signed_tx.result()["hex"])
+        batch.execute()
 
     while (node.getmempoolinfo()['size'] > 0):
         node.generate(1)
@@ -619,21 +981,29 @@ def create_tx(node, coinbase, to_address, amount):
 # transaction to make it large.  See gen_return_txouts() above.
 def create_lots_of_big_transactions(node, txouts, utxos, fee):
     addr = node.getnewaddress()
-    txids = []
-    for i in range(len(utxos)):
-        t = utxos.pop()
-        inputs = []
-        inputs.append({ "txid" : t["txid"], "vout" : t["vout"]})
-        outputs = {}
-        send_value = t['amount'] - fee
-        outputs[addr] = satoshi_round(send_value)
-        rawtx = node.createrawtransaction(inputs, outputs)
-        newtx = rawtx[0:92]
-        newtx = newtx + txouts
-        newtx = newtx + rawtx[94:]
-        signresult = node.signrawtransaction(newtx, None, None, "NONE")
-        txid = node.sendrawtransaction(signresult["hex"], True)
-        txids.append(txid)
+    # Create, sign and send the transactions one batch of RPC calls per step
+    with node.batch() as batch:
+        rawtxs = []
+        for i in range(len(utxos)):
+            t = utxos.pop()
+            inputs = []
+            inputs.append({ "txid" : t["txid"], "vout" : t["vout"]})
+            outputs = {}
+            send_value = t['amount'] - fee
+            outputs[addr] = satoshi_round(send_value)
+            rawtxs.append(batch.createrawtransaction(inputs, outputs))
+    with node.batch() as batch:
+        signresults = []
+        for rawtx in rawtxs:
+            rawtx = rawtx.result()
+            newtx = rawtx[0:92]
+            newtx = newtx + txouts
+            newtx = newtx + rawtx[94:]
+            signresults.append(batch.signrawtransaction(newtx, None, None, "NONE"))
+    with node.batch() as batch:
+        for signresult in signresults:
+            batch.sendrawtransaction(signresult.result()["hex"], True)
+        txids = batch.execute()
     return txids
 
 def get_bip9_status(node, key):
@@ -649,4 +1019,43 @@ def slow_gen(node, count):
         blocks.extend(node.generate(now))
         total -= now
         time.sleep(0.1)
-    return blocks
\ No newline at end of file
+    return blocks
+
+def fast_gen(node, count, block_time=None, block_spacing=10*60, peers=None):
+    """
+    Generate count blocks on node as fast as it can mine them and return
+    their hashes.
+
+    Without block_time the blocks get the node's (mock)time, as with
+    slow_gen.  With block_time, the node's mocktime is set to block_time
+    for the first block and advanced by block_spacing for each following
+    one; the setmocktime/generate pairs are sent as JSON-RPC batches, so a
+    block costs no round trip of its own.  peers, the other nodes the
+    blocks will reach, get the last block's time up front so none of them
+    is too new for them.  The node and its peers are left with their
+    mocktime at the last block's time; reset it with set_node_times if the
+    test needs another.
+
+    Reports blocks/sec with PYTHON_DEBUG set.
+    """
+    start = time.time()
+    blocks = []
+    if block_time is None:
+        while len(blocks) < count:
+            blocks.extend(node.generate(min(count - len(blocks), FAST_GEN_CHUNK)))
+    else:
+        if peers is not None:
+            set_node_times(peers, block_time + (count - 1) * block_spacing)
+        while len(blocks) < count:
+            with node.batch() as batch:
+                for i in range(min(count - len(blocks), FAST_GEN_BATCH)):
+                    batch.setmocktime(block_time)
+                    batch.generate(1)
+                    block_time += block_spacing
+                results = batch.execute()
+            for hashes in results[1::2]:
+                blocks.extend(hashes)
+    if os.getenv("PYTHON_DEBUG", ""):
+        elapsed = time.time() - start
+        print("fast_gen: %d blocks in %.2fs (%.0f blocks/s)" % (count, elapsed, count / max(elapsed, 1e-9)))
+    return blocks